@@ -0,0 +1,134 @@
+""" Load test for the DSB api
+
+Usage: python -m benchmarks.api_load [--url <url>] [--requests <n>] [--concurrency <n>]
+
+Without --url a local api is started on a temporary database with a sample plan.
+Reports requests/sec and latency percentiles for /where_next and /get_plan.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import tempfile
+import time
+import aiohttp
+import jsonpickle
+from dsb.api.dsbapi import DSBApiThread
+from dsb.data.database import Database
+from dsb.types.lesson import Lesson
+from dsb.types.plan import Plan
+
+SAMPLE_GROUP = 1
+SAMPLE_PLAN = "sample"
+
+def sample_plan() -> Plan:
+    """ Create a plan with a full week of lessons """
+    plan = Plan(owner=0)
+    for day in range(1, 6):
+        for hour in range(8, 18, 2):
+            plan.add_lesson(day - 1, Lesson({
+                "day": str(day),
+                "start": f"{hour:02}:00",
+                "end": f"{hour + 1:02}:30",
+                "subject": f"Subject {hour}",
+                "type": "lecture",
+                "room": f"{day}{hour:02}",
+                "repeat": "not"
+            }))
+    return plan
+
+def seed_database(path: str) -> Database:
+    """ Create database with a single sample plan """
+    database = Database(path)
+    with open(f"{path}/chat_data/{SAMPLE_GROUP}.json", "w", encoding="utf-8") as f:
+        f.write(jsonpickle.encode({"plans": {SAMPLE_PLAN: sample_plan()}}, keys=True, indent=4))
+    return database
+
+def free_port() -> int:
+    """ Get a free local port """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def percentile(values: list[float], pct: float) -> float:
+    """ Nearest-rank percentile """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[idx]
+
+async def hammer(url: str, total: int, concurrency: int) -> dict:
+    """ Send `total` GET requests using `concurrency` parallel clients """
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        for _ in remaining:
+            start = time.perf_counter()
+            async with session.get(url) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": total / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+async def run(base_url: str, group_id: int, plan_name: str,
+              total: int, concurrency: int) -> None:
+    """ Run the load test against every endpoint """
+    query = f"group_id={group_id}&plan_name={plan_name}"
+    for endpoint in ("where_next", "get_plan"):
+        result = await hammer(f"{base_url}/{endpoint}?{query}", total, concurrency)
+        print(f"/{endpoint}: {result['rps']:.1f} req/s, p50 {result['p50_ms']:.2f} ms, "
+              f"p99 {result['p99_ms']:.2f} ms, {result['errors']} errors")
+
+def main() -> None:
+    """ Parse arguments and run the load test """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base url of a running api, local one is started if omitted")
+    parser.add_argument("--group-id", type=int, default=SAMPLE_GROUP)
+    parser.add_argument("--plan-name", default=SAMPLE_PLAN)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=8, help="worker threads of the local api")
+    parser.add_argument("--startup-timeout", type=float, default=10,
+                        help="seconds to wait for the local api to start")
+    args = parser.parse_args()
+
+    api = None
+    base_url = args.url
+    with tempfile.TemporaryDirectory() as tmp:
+        if base_url is None:
+            port = free_port()
+            api = DSBApiThread(seed_database(os.path.join(tmp, "database")), port, args.workers)
+            api.start()
+            base_url = f"http://127.0.0.1:{port}"
+        try:
+            if api is not None and not api.ready.wait(args.startup_timeout):
+                raise SystemExit(f"Local api did not start within {args.startup_timeout:g} s")
+            asyncio.run(run(base_url.rstrip("/"), args.group_id, args.plan_name,
+                            args.requests, args.concurrency))
+        finally:
+            if api is not None:
+                api.shutdown()
+                api.join()
+
+if __name__ == "__main__":
+    main()
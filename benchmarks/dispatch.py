@@ -0,0 +1,77 @@
+""" Command dispatch cost against the number of registered commands
+
+Usage: python -m benchmarks.dispatch [--commands 10 50 200 1000] [--updates <n>]
+
+Compares one DSBCommandHandler per command, checked one by one like the
+application does, with the CommandRouter dictionary lookup. The measured
+command is registered last, the worst case for the linear scan.
+"""
+
+import argparse
+import functools
+import time
+from datetime import datetime
+from telegram import Bot, Chat, Message, MessageEntity, Update, User
+from telegram.ext import BaseHandler
+from dsb.types.handlers import CommandRouter, DSBCommandHandler
+
+class FakeDSB: # pylint: disable=R0903
+    """ Just the admins the router needs """
+    admins = [1]
+
+async def noop(*_) -> None:
+    """ Command callback """
+
+def make_update(bot: Bot, text: str) -> Update:
+    """ Update with a bot command at the start of the text """
+    command = text.split()[0]
+    message = Message(1, datetime.now(), Chat(1, Chat.PRIVATE), from_user=User(1, "user", False),
+                      text=text, entities=[MessageEntity(MessageEntity.BOT_COMMAND, 0,
+                                                         len(command))])
+    message.set_bot(bot)
+    update = Update(1, message=message)
+    update.set_bot(bot)
+    return update
+
+def linear(handlers: list[BaseHandler], update: Update) -> BaseHandler | None:
+    """ First handler accepting the update, like Application.process_update """
+    for handler in handlers:
+        if handler.check_update(update) not in (None, False):
+            return handler
+    return None
+
+def measure(func, update: Update, repeat: int) -> float:
+    """ Average seconds per call """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(update)
+    return (time.perf_counter() - start) / repeat
+
+def main() -> None:
+    """ Parse arguments and print the dispatch cost table """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, nargs="+", default=[10, 50, 200, 1000])
+    parser.add_argument("--updates", type=int, default=2000)
+    args = parser.parse_args()
+
+    bot = Bot("1:benchmark")
+    bot._bot_user = User(2, "bot", True, username="dsb_bot")  # pylint: disable=protected-access
+
+    print(f"{'commands':>8}  {'handlers us':>11}  {'router us':>9}  {'speedup':>7}")
+    for count in args.commands:
+        names = [f"command{i}" for i in range(count)]
+        handlers = [DSBCommandHandler(name, noop) for name in names]
+        router = CommandRouter(FakeDSB())
+        for name in names:
+            router.add(name, noop)
+        update = make_update(bot, f"/{names[-1]} arg")
+        assert linear(handlers, update) is handlers[-1]
+        assert router.check_update(update)[1].command == names[-1]
+
+        scan = measure(functools.partial(linear, handlers), update, args.updates)
+        routed = measure(router.check_update, update, args.updates)
+        print(f"{count:>8}  {scan * 1e6:>11.2f}  {routed * 1e6:>9.2f}  {scan / routed:>6.1f}x")
+
+if __name__ == "__main__":
+    main()
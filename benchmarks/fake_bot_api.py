@@ -0,0 +1,221 @@
+""" Local stand-in for the Telegram Bot API
+
+Usage: python -m benchmarks.fake_bot_api [--port <port>] [--updates <updates.jsonl>]
+
+Serves getUpdates from a queue of scripted or recorded updates and answers
+the methods DSB calls with plausible results, recording every call. Point the
+bot at it with bot_api_url=http://127.0.0.1:<port> in .env.
+
+More updates can be queued by POSTing a JSON list to /_feed, GET /_status
+returns the number of pending updates, seconds since the last call of the
+bot, the time from the first delivered update to the last call and the
+number of calls of every method.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "DSB", "username": "dsb_bot"}
+
+class Call: # pylint: disable=R0903
+    """ Bot API request received from the bot """
+    __slots__ = ("method", "params", "time")
+
+    def __init__(self, method: str, params: dict, time_: float) -> None:
+        self.method = method
+        self.params = params
+        self.time = time_
+
+class FakeBotApi(threading.Thread):
+    """ Bot API server running on its own thread and event loop
+
+    Updates given to feed are handed out by getUpdates in order, `delivered`
+    keeps the time every update was returned to the bot.
+    """
+    def __init__(self, port: int) -> None:
+        threading.Thread.__init__(self, name="fake-bot-api", daemon=True)
+        self.port = port
+        self.calls: list[Call] = []
+        self.delivered: dict[int, float] = {}
+        self.ready = threading.Event()
+        self._updates: list[dict] = []
+        self._fed = 0
+        self._message_ids = itertools.count(1_000_000)
+        self._loop = asyncio.new_event_loop()
+        self._new_updates = asyncio.Event()
+        self._stop_event = asyncio.Event()
+        self._app = web.Application()
+        self._app.router.add_post("/bot{token}/{method}", self.handle)
+        self._app.router.add_get("/bot{token}/{method}", self.handle)
+        self._app.router.add_get("/file/bot{token}/{path:.*}", self.file)
+        self._app.router.add_post("/_feed", self.feed_handler)
+        self._app.router.add_get("/_status", self.status)
+
+    @property
+    def url(self) -> str:
+        """ Value for bot_api_url """
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def pending(self) -> int:
+        """ Updates fed but not delivered yet """
+        return self._fed - len(self.delivered)
+
+    def feed(self, updates: list[dict]) -> None:
+        """ Queue updates for getUpdates, safe to call from any thread """
+        self._fed += len(updates)
+        self._loop.call_soon_threadsafe(self.__feed, updates)
+
+    def __feed(self, updates: list[dict]) -> None:
+        self._updates.extend(updates)
+        self._new_updates.set()
+
+    def last_call(self, exclude: tuple[str, ...] = ("getUpdates",)) -> float | None:
+        """ Time of the last call apart from the excluded methods """
+        for call in reversed(self.calls):
+            if call.method not in exclude:
+                return call.time
+        return None
+
+    def summary(self) -> Counter:
+        """ Number of calls of every method """
+        return Counter(call.method for call in self.calls)
+
+    def run(self) -> None:
+        """ Serve until shutdown """
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self.__serve())
+        finally:
+            self._loop.close()
+
+    async def __serve(self) -> None:
+        runner = web.AppRunner(self._app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", self.port).start()
+        self.ready.set()
+        try:
+            await self._stop_event.wait()
+        finally:
+            await runner.cleanup()
+
+    def shutdown(self) -> None:
+        """ Stop the server """
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    async def __get_updates(self, params: dict) -> list[dict]:
+        """ Updates from the offset on, waiting up to timeout seconds for new ones """
+        offset = int(params.get("offset", 0) or 0)
+        limit = int(params.get("limit", 100) or 100)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.pop(0)
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(),
+                                       float(params.get("timeout", 0) or 0))
+            except asyncio.TimeoutError:
+                return []
+        updates = self._updates[:limit]
+        now = time.perf_counter()
+        for update in updates:
+            self.delivered.setdefault(update["update_id"], now)
+        return updates
+
+    def __message(self, params: dict, **fields) -> dict:
+        """ Message sent by the bot """
+        chat_id = int(params.get("chat_id", 0))
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+                "from": BOT_USER, **fields}
+
+    async def __result(self, method: str, params: dict):
+        """ Result of the method """
+        match method:
+            case "getMe":
+                return BOT_USER
+            case "getUpdates":
+                return await self.__get_updates(params)
+            case "sendMessage" | "editMessageText":
+                return self.__message(params, text=params.get("text", ""))
+            case "sendPhoto":
+                file_id = f"photo{next(self._message_ids)}"
+                return self.__message(params, photo=[{
+                    "file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}])
+            case "editMessageReplyMarkup":
+                return self.__message(params)
+            case "getFile":
+                file_id = params.get("file_id", "")
+                return {"file_id": file_id, "file_unique_id": file_id,
+                        "file_path": f"files/{file_id}"}
+            case _:
+                return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """ Answer a Bot API method """
+        method = request.match_info["method"]
+        params = dict(await request.post()) if request.can_read_body else dict(request.query)
+        for key, value in params.items():
+            if not isinstance(value, str):
+                params[key] = getattr(value, "filename", None) or "<file>"
+        self.calls.append(Call(method, params, time.perf_counter()))
+        result = await self.__result(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def feed_handler(self, request: web.Request) -> web.Response:
+        """ Queue the POSTed list of updates """
+        updates = await request.json()
+        self._fed += len(updates)
+        self.__feed(updates)
+        return web.json_response({"fed": len(updates)})
+
+    async def status(self, _: web.Request) -> web.Response:
+        """ Progress of the bot through the fed updates """
+        last_call = self.last_call()
+        now = time.perf_counter()
+        elapsed = None
+        if last_call is not None and self.delivered:
+            elapsed = last_call - min(self.delivered.values())
+        return web.json_response({
+            "pending": self.pending,
+            "idle": None if last_call is None else now - last_call,
+            "elapsed": elapsed,
+            "calls": dict(self.summary().most_common()),
+        })
+
+    async def file(self, _: web.Request) -> web.Response:
+        """ Content of a file returned by getFile """
+        return web.Response(body=b"\xff\xd8\xff\xd9")
+
+def main() -> None:
+    """ Run the server until interrupted and print the calls it received """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--updates", help="file with one update per line to serve")
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.port)
+    api.start()
+    api.ready.wait()
+    if args.updates:
+        with open(args.updates, "r", encoding="utf-8") as f:
+            api.feed([json.loads(line) for line in f if line.strip()])
+    print(f"Serving on {api.url}, set bot_api_url={api.url} in .env")
+    try:
+        api.join()
+    except KeyboardInterrupt:
+        api.shutdown()
+        api.join()
+    for method, count in api.summary().most_common():
+        print(f"{count:>8}  {method}")
+
+if __name__ == "__main__":
+    main()
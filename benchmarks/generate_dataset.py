@@ -0,0 +1,150 @@
+""" Synthetic database for scale tests
+
+Usage: python -m benchmarks.generate_dataset [--path <dir>] [--chats <n>] [--plans <n>]
+       [--students <n>] [--haikus <n>] [--sets <n>] [--images <n>] [--seed <n>]
+       [--backend jsonpickle] [--force]
+
+Writes chat, user and bot data through the persistence backend and image
+sets through the image store, so the same seed and sizes give the same tree
+in any backend listed in BACKENDS. Plans get a full week of lessons with odd
+and even week repeats, owners and students, chats get haikus and image sets
+with some images shared between chats.
+
+Without --path the dataset goes to a new temporary directory. A directory
+that is not empty, like the live dsb/database, is only written with --force.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from dsb.data.database import Database
+from dsb.data.persistence import CustomPersistance
+from dsb.types.lesson import Lesson
+from dsb.types.plan import Plan
+
+BACKENDS = {
+    "jsonpickle": CustomPersistance,
+}
+SUBJECTS = [
+    "Mathematics", "Physics", "Algorithms", "Databases", "Networks", "Statistics",
+    "Operating Systems", "Compilers", "Linear Algebra", "English", "Electronics",
+    "Signal Processing", "Graphics", "Security", "Machine Learning", "Economics",
+]
+TYPES = ["lecture", "lab", "exercises", "seminar", "project"]
+REPEATS = ["not", "not", "not", "even", "odd"]
+HAIKU_WORDS = ["autumn", "moonlight", "silent", "river", "cherry", "blossom", "winter",
+               "morning", "lecture", "coffee", "deadline", "falling", "leaves", "quiet"]
+
+def random_lesson(rng: random.Random, day: int, start_hour: int) -> Lesson:
+    """ Lesson of a random subject starting at the hour """
+    start_minute = rng.choice((0, 15, 30))
+    length = rng.choice((45, 90, 90, 135))
+    end = start_hour * 60 + start_minute + length
+    return Lesson({
+        "day": str(day + 1),
+        "start": f"{start_hour:02}:{start_minute:02}",
+        "end": f"{end // 60:02}:{end % 60:02}",
+        "subject": rng.choice(SUBJECTS),
+        "type": rng.choice(TYPES),
+        "room": f"{rng.choice('ABCDE')}{rng.randint(1, 4)}{rng.randint(0, 40):02}",
+        "repeat": rng.choice(REPEATS),
+    })
+
+def random_plan(rng: random.Random, owner: int, students: int) -> Plan:
+    """ Plan with lessons from Monday to Friday and its students """
+    plan = Plan(owner)
+    for day in range(5):
+        for hour in sorted(rng.sample(range(8, 19), rng.randint(3, 7))):
+            plan.add_lesson(day, random_lesson(rng, day, hour))
+    for student in rng.sample(range(students * 4), rng.randint(1, students)):
+        plan.add_student(f"student{student}")
+    return plan
+
+def random_haiku(rng: random.Random) -> str:
+    """ Three lines of words """
+    return "\n".join(" ".join(rng.choice(HAIKU_WORDS) for _ in range(count))
+                     for count in (3, 4, 3))
+
+def random_chat(rng: random.Random, plans: int, students: int, haikus: int) -> dict:
+    """ Chat data with plans and haikus """
+    users = [f"user{rng.randrange(100000)}" for _ in range(max(1, haikus // 4))]
+    chat_haikus: dict[str, list[str]] = {}
+    for _ in range(haikus):
+        chat_haikus.setdefault(rng.choice(users), []).append(random_haiku(rng))
+    return {
+        "plans": {f"plan{index}": random_plan(rng, rng.randrange(1, 10**9), students)
+                  for index in range(plans)},
+        "haikus": chat_haikus,
+    }
+
+def random_image(rng: random.Random, size: int = 4096) -> bytes:
+    """ Bytes with a JPEG header, the image store does not decode them """
+    return b"\xff\xd8\xff\xe0" + rng.randbytes(size) + b"\xff\xd9"
+
+async def generate(path: str, chats: int, plans: int, # pylint: disable=R0913,R0914,R0917
+                   students: int, haikus: int, sets: int, images: int, seed: int = 0,
+                   backend: str = "jsonpickle") -> dict[str, int]:
+    """ Write the dataset, returns the number of written objects """
+    rng = random.Random(seed)
+    persistence = BACKENDS[backend](store_path=path)
+    database = Database(path)
+    shared = [random_image(rng) for _ in range(max(1, images))]
+    daily_images = {}
+    counts = {"chats": 0, "plans": 0, "lessons": 0, "haikus": 0, "images": 0, "users": 0}
+    for index in range(chats):
+        chat_id = -1_000_000 - index
+        chat = random_chat(rng, plans, students, haikus)
+        chat["sets"] = {f"set{number}" for number in range(sets)}
+        for set_name in chat["sets"]:
+            for _ in range(images):
+                image = rng.choice(shared) if rng.random() < 0.3 else random_image(rng)
+                database.save_image(chat_id, set_name, image)
+                counts["images"] += 1
+        if chat["sets"] and rng.random() < 0.5:
+            daily_images[chat_id] = rng.choice(sorted(chat["sets"]))
+        await persistence.update_chat_data(chat_id, chat)
+        for student in range(min(students, 5)):
+            await persistence.update_user_data(
+                rng.randrange(1, 10**9), {f"{chat_id}_plan_name": f"plan{student % max(1, plans)}"})
+            counts["users"] += 1
+        counts["chats"] += 1
+        counts["plans"] += len(chat["plans"])
+        counts["lessons"] += sum(len(plan.get_all()[day]) for plan in chat["plans"].values()
+                                 for day in range(5))
+        counts["haikus"] += sum(len(texts) for texts in chat["haikus"].values())
+    await persistence.update_bot_data({"daily_images": daily_images})
+    return counts
+
+def main() -> None:
+    """ Parse arguments and write the dataset """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", help="database directory, a new temporary one by default")
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--plans", type=int, default=24, help="plans in every chat")
+    parser.add_argument("--students", type=int, default=30, help="maximum students of a plan")
+    parser.add_argument("--haikus", type=int, default=20, help="haikus in every chat")
+    parser.add_argument("--sets", type=int, default=2, help="image sets in every chat")
+    parser.add_argument("--images", type=int, default=3, help="images in every set")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="jsonpickle")
+    parser.add_argument("--force", action="store_true",
+                        help="write into a directory that is not empty")
+    args = parser.parse_args()
+
+    if args.path is None:
+        args.path = tempfile.mkdtemp(prefix="dsb-dataset-")
+    elif os.path.isdir(args.path) and os.listdir(args.path) and not args.force:
+        parser.error(f"{args.path} is not empty, pass --force to write into it")
+
+    start = time.perf_counter()
+    counts = asyncio.run(generate(args.path, args.chats, args.plans, args.students, args.haikus,
+                                  args.sets, args.images, args.seed, args.backend))
+    print(", ".join(f"{count} {name}" for name, count in counts.items())
+          + f" written to {args.path} in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+""" POST recorded updates to a webhook endpoint
+
+Usage: python -m benchmarks.post_updates <updates.jsonl> --url <url> --secret <token>
+       [--concurrency <n>]
+
+Every line of the file is one update as returned by getUpdates. Reports the
+status codes and the latency of the webhook answering the requests.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+import aiohttp
+from benchmarks.api_load import percentile
+from dsb.api.webhook import SECRET_HEADER
+
+async def post_updates(url: str, secret: str, updates: list[dict],
+                       concurrency: int) -> tuple[Counter, list[float], float]:
+    """ Send the updates, returns status counts, latencies and total time """
+    statuses = Counter()
+    latencies = []
+    remaining = iter(updates)
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        for update in remaining:
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers={SECRET_HEADER: secret}) as response:
+                await response.read()
+                statuses[response.status] += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+        return statuses, latencies, time.perf_counter() - start
+
+def main() -> None:
+    """ Parse arguments and post the updates """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("updates", help="file with one update per line")
+    parser.add_argument("--url", required=True,
+                        help="webhook url, e.g. http://127.0.0.1:8000/telegram")
+    parser.add_argument("--secret", required=True, help="webhook_secret of the bot")
+    parser.add_argument("--concurrency", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.updates, "r", encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    statuses, latencies, elapsed = asyncio.run(
+        post_updates(args.url, args.secret, updates, args.concurrency))
+    print(f"{len(updates)} updates in {elapsed:.2f} s, "
+          + ", ".join(f"{count}x {status}" for status, count in sorted(statuses.items())))
+    print(f"p50 {percentile(latencies, 50) * 1000:.2f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
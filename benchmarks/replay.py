@@ -0,0 +1,176 @@
+""" Replay updates through DSB against the fake Bot API
+
+Usage: python -m benchmarks.replay [--updates <n>] [--chats <n>] [--file <updates.jsonl>]
+       [--concurrency <n>]
+
+Runs the bot in a temporary working directory with bot_api_url pointing at
+benchmarks.fake_bot_api, feeds it scripted updates (or the recorded ones from
+--file) and stops it with /quit once it went idle. Reports updates/sec,
+latency of every command and persistence I/O.
+
+The fake api runs in its own process, sharing the interpreter with the bot
+would add GIL handoffs to every request and skew concurrent runs.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime
+from benchmarks.api_load import free_port
+from dsb.dsb import DSB
+from dsb.utils.metrics import REGISTRY
+
+ADMIN = 1
+SCRIPT = [
+    "/who_am_i", "/help", "/plans", "/create_plan plan{n}", "/where_now", "/random_haiku",
+    "/silly_cipher hello {n}", "hello there {n}", "what a nice day {n}", "/whoami",
+]
+
+def command_update(update_id: int, chat_id: int, user_id: int, message_id: int,
+                   text: str) -> dict:
+    """ Update with a text message, bot commands get their entity """
+    message = {"message_id": message_id, "date": int(datetime.now().timestamp()),
+               "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group",
+                        "title": f"Chat {chat_id}"},
+               "from": {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"},
+               "text": text}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0,
+                                "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+def scripted_updates(total: int, chats: int, seed: int = 0) -> list[dict]:
+    """ Messages cycling through SCRIPT spread randomly over the group chats """
+    rng = random.Random(seed)
+    message_ids = [0] * chats
+    updates = []
+    for update_id in range(1, total + 1):
+        chat = rng.randrange(chats)
+        message_ids[chat] += 1
+        text = SCRIPT[update_id % len(SCRIPT)].format(n=update_id)
+        updates.append(command_update(update_id, -1000 - chat, 100 + rng.randrange(chats * 5),
+                                      message_ids[chat], text))
+    return updates
+
+def load_updates(path: str) -> list[dict]:
+    """ Recorded updates, one per line """
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class FakeApiProcess:
+    """ benchmarks.fake_bot_api running in a subprocess """
+    def __init__(self) -> None:
+        self.url = f"http://127.0.0.1:{free_port()}"
+        self._process = subprocess.Popen( # pylint: disable=R1732
+            [sys.executable, "-m", "benchmarks.fake_bot_api", "--port", self.url.rsplit(":", 1)[1]],
+            stdout=subprocess.DEVNULL)
+        for _ in range(100):
+            try:
+                self.status()
+                return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("Fake Bot API did not start")
+
+    def status(self) -> dict:
+        """ Progress reported by /_status """
+        with urllib.request.urlopen(f"{self.url}/_status") as response:
+            return json.load(response)
+
+    def feed(self, updates: list[dict]) -> None:
+        """ Queue updates for the bot """
+        request = urllib.request.Request(f"{self.url}/_feed", json.dumps(updates).encode(),
+                                         {"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            response.read()
+
+    def stop(self) -> None:
+        """ Terminate the process """
+        self._process.terminate()
+        self._process.wait()
+
+def prepare_workspace(path: str, api: FakeApiProcess, concurrency: int) -> None:
+    """ Working directory with its own database, .env and the bot modules """
+    os.makedirs(os.path.join(path, "dsb"))
+    os.symlink(os.path.abspath("dsb/modules"), os.path.join(path, "dsb", "modules"))
+    with open(os.path.join(path, ".env"), "w", encoding="utf-8") as f:
+        f.write(f"token=1:replay\nadmins={ADMIN}\napi_port={free_port()}\n"
+                f"bot_api_url={api.url}\nconcurrent_updates={concurrency}\n")
+
+def stop_when_idle(api: FakeApiProcess, last_id: int, idle: float, result: dict) -> None:
+    """ Send /quit once every update was fetched and the bot stopped calling the api """
+    while True:
+        time.sleep(0.05)
+        status = api.status()
+        if status["pending"] == 0 and status["idle"] is not None and status["idle"] > idle:
+            break
+    result.update(status)
+    api.feed([command_update(last_id + 1, ADMIN, ADMIN, 1, "/quit")])
+
+def report(status: dict, updates: list[dict]) -> None:
+    """ Print throughput, command latencies, persistence I/O and api calls """
+    elapsed = status["elapsed"]
+    print(f"\n{len(updates)} updates in {elapsed:.2f} s, "
+          f"{len(updates) / elapsed:.1f} updates/s")
+
+    print(f"\n{'handler':<24}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    handlers = sorted(REGISTRY.histograms("dsb_handler_seconds"),
+                      key=lambda item: item[1].count, reverse=True)
+    for labels, histogram in handlers:
+        if histogram.count:
+            print(f"{labels['handler']:<24}{histogram.count:>8}"
+                  f"{histogram.sum / histogram.count * 1000:>10.2f}"
+                  f"{histogram.quantile(0.5) * 1000:>10.1f}"
+                  f"{histogram.quantile(0.99) * 1000:>10.1f}")
+
+    print(f"\n{'persistence':<24}{'count':>8}{'total ms':>10}")
+    for labels, histogram in REGISTRY.histograms("dsb_persistence_seconds"):
+        if histogram.count:
+            print(f"{labels['operation'] + ' ' + labels['store']:<24}{histogram.count:>8}"
+                  f"{histogram.sum * 1000:>10.1f}")
+
+    print(f"\n{'bot api method':<24}{'calls':>8}")
+    for method, count in status["calls"].items():
+        print(f"{method:<24}{count:>8}")
+
+def main() -> None:
+    """ Parse arguments and replay the updates """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--file", help="recorded updates to replay instead of the script")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="concurrent_updates of the bot, 1 processes them one by one")
+    parser.add_argument("--idle", type=float, default=1.0,
+                        help="seconds without api calls after which the bot is done")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file) if args.file else scripted_updates(args.updates, args.chats)
+    api = FakeApiProcess()
+    cwd = os.getcwd()
+    result = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare_workspace(tmp, api, args.concurrency)
+        os.chdir(tmp)
+        try:
+            dsb = DSB()
+            api.feed(updates)
+            last_id = max(update["update_id"] for update in updates)
+            threading.Thread(target=stop_when_idle, args=(api, last_id, args.idle, result),
+                             daemon=True).start()
+            dsb.start()
+        finally:
+            os.chdir(cwd)
+            api.stop()
+    report(result, updates)
+
+if __name__ == "__main__":
+    main()
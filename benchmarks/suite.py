@@ -0,0 +1,311 @@
+""" Benchmarks of the bot's hot paths compared against a stored baseline
+
+Usage: python -m benchmarks.suite [--filter <text>] [--repeat <n>] [--output <results.json>]
+       [--baseline <baseline.json>] [--update-baseline] [--tolerance <fraction>]
+
+Runs offline on data from benchmarks.generate_dataset. Every benchmark is
+timed with timeit, the fastest time per call of --repeat samples is compared
+with the baseline, as it is the least affected by other load. A benchmark
+slower than the tolerance allows is measured once more before the run fails.
+Results are written as JSON, --update-baseline stores them as the new
+baseline. Timings only compare between runs on the same machine.
+"""
+# pylint: disable=protected-access
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import string
+import sys
+import tempfile
+import timeit
+from types import SimpleNamespace
+from typing import Callable
+import aiohttp
+import jsonpickle
+from benchmarks.api_load import free_port
+from benchmarks.generate_dataset import random_chat, random_plan
+from dsb.api.dsbapi import DSBApiThread
+from dsb.data.database import Database
+from dsb.types.errors import DSBError
+from dsb.types.lesson import Lesson
+from dsb.types.module import BaseModule
+from dsb.utils.logs import LogBuffer, tail
+from dsb.modules.message_handler import MessageHandler
+from dsb.modules.planner import Planner
+from dsb.modules.wordle import Wordle
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+BENCHMARKS: dict[str, Callable[["Fixture"], Callable[[], object]]] = {}
+
+def benchmark(name: str):
+    """ Register setup function returning the callable to time """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+class Fixture:
+    """ Shared data and resources of the benchmarks, created on first use """
+    def __init__(self, seed: int = 0) -> None:
+        self.seed = seed
+        self.loop = asyncio.new_event_loop()
+        self._tmp = tempfile.TemporaryDirectory() # pylint: disable=R1732
+        self._api: DSBApiThread | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._chat: dict | None = None
+
+    def rng(self) -> random.Random:
+        """ Random generator with the fixture seed """
+        return random.Random(self.seed)
+
+    @property
+    def chat(self) -> dict:
+        """ Chat data with 50 plans """
+        if self._chat is None:
+            self._chat = random_chat(self.rng(), 50, 30, 20)
+        return self._chat
+
+    def run(self, coroutine):
+        """ Run coroutine on the fixture loop """
+        return self.loop.run_until_complete(coroutine)
+
+    def api(self) -> tuple[str, aiohttp.ClientSession]:
+        """ Url of a running api with the chat stored as group 1 and a client session """
+        if self._api is None:
+            path = os.path.join(self._tmp.name, "database")
+            Database(path)
+            with open(os.path.join(path, "chat_data", "1.json"), "w", encoding="utf-8") as f:
+                f.write(jsonpickle.encode(self.chat, keys=True, indent=4))
+            self._api = DSBApiThread(Database(path), free_port())
+            self._api.start()
+            self._api.ready.wait(5)
+            self._session = self.run(self.__session())
+        return f"http://127.0.0.1:{self._api._port}", self._session
+
+    @staticmethod
+    async def __session() -> aiohttp.ClientSession:
+        return aiohttp.ClientSession()
+
+    def close(self) -> None:
+        """ Stop the api and remove temporary files """
+        if self._session is not None:
+            self.run(self._session.close())
+        if self._api is not None:
+            self._api.shutdown()
+            self._api.join()
+        self.loop.close()
+        self._tmp.cleanup()
+
+LESSON = {"day": "3", "start": "10:15", "end": "11:45", "subject": "Algorithms",
+          "type": "lecture", "room": "B204", "repeat": "odd"}
+
+@benchmark("plan.to_image")
+def _plan_to_image(fixture: Fixture):
+    plan = random_plan(fixture.rng(), 1, 30)
+    return lambda: plan.to_image("Plan", "png", 150)
+
+@benchmark("planner.status_200_plans")
+def _planner_status(fixture: Fixture):
+    rng = fixture.rng()
+    context = SimpleNamespace(chat_data={"plans": {f"plan{index}": random_plan(rng, 1, 30)
+                                                   for index in range(200)}})
+    planner = Planner(None, None)
+    return lambda: planner._Planner__get_status(context)
+
+@benchmark("lesson.construct")
+def _lesson_construct(_: Fixture):
+    return lambda: Lesson(LESSON)
+
+@benchmark("lesson.validate_invalid")
+def _lesson_invalid(_: Fixture):
+    invalid = dict(LESSON, repeat="weekly")
+
+    def construct() -> None:
+        try:
+            Lesson(invalid)
+        except DSBError:
+            pass
+    return construct
+
+@benchmark("jsonpickle.encode_chat")
+def _jsonpickle_encode(fixture: Fixture):
+    chat = fixture.chat
+    return lambda: jsonpickle.encode(chat, keys=True, indent=4)
+
+@benchmark("jsonpickle.decode_chat")
+def _jsonpickle_decode(fixture: Fixture):
+    encoded = jsonpickle.encode(fixture.chat, keys=True, indent=4)
+    return lambda: jsonpickle.decode(encoded, keys=True)
+
+@benchmark("message_handler.detect_haikus")
+def _detect_haikus(_: Fixture):
+    handler = MessageHandler(None, None)
+    handler.warm_up()
+    messages = ["An old silent pond a frog jumps into the pond splash silence again",
+                "this message is not a haiku at all but it is long enough to check"]
+
+    def detect() -> None:
+        for message in messages:
+            handler._MessageHandler__detect_haikus(message)
+    return detect
+
+@benchmark("message_handler.cipher")
+def _cipher(fixture: Fixture):
+    handler = MessageHandler(None, None)
+    rng = fixture.rng()
+    text = "".join(rng.choice(string.ascii_letters + string.digits + " ") for _ in range(500))
+    return lambda: handler.cipher(text)
+
+@benchmark("wordle.words_for_image")
+def _wordle(fixture: Fixture):
+    wordle = Wordle(None, None)
+    rng = fixture.rng()
+    wordle._words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(5))
+                     for _ in range(2000)]
+    wordle._answer = wordle._words[0]
+    image = [[0, 0, 0, 0, 0], [0, 1, 1, 1, 0], [1, 1, 0, 0, 0], [0, 1, 1, 1, 0]]
+    return lambda: fixture.run(wordle._get_words_for_image(image))
+
+@benchmark("base_module.get_args")
+def _get_args(_: Fixture):
+    module = BaseModule(None, None)
+    context = SimpleNamespace(args="plan1 --day monday --start 10:15 --end 11:45 "
+                                   "--subject Algorithms --type lecture --room B204".split())
+    return lambda: module._get_args(context)
+
+@benchmark("base_module.parse_command")
+def _parse_command(_: Fixture):
+    module = BaseModule(None, None)
+    context = SimpleNamespace(args="plan1 --day 3 --start 10:15 --end 11:45 "
+                                   "--subject Algorithms --type lecture --room B204".split())
+    required = {"day": int, "start": str, "end": str}
+    optional = {"room": str}
+    return lambda: module._parse_command(context, required, optional)
+
+def _log_records(count: int):
+    """ Info records with an error every 100 records """
+    for index in range(count):
+        level = logging.ERROR if index % 100 == 0 else logging.INFO
+        yield logging.LogRecord("DSB", level, __file__, 0, "update %d handled", (index,), None)
+
+@benchmark("logs.buffer_errors")
+def _log_buffer(_: Fixture):
+    buffer = LogBuffer(1000)
+    for record in _log_records(1000):
+        buffer.handle(record)
+    return lambda: buffer.lines(5, "error")
+
+@benchmark("logs.tail_errors_200k")
+def _log_tail(fixture: Fixture):
+    path = os.path.join(fixture._tmp.name, "dsb.log")
+    formatter = LogBuffer().formatter
+    with open(path, "w", encoding="utf-8") as f:
+        for record in _log_records(200_000):
+            f.write(formatter.format(record) + "\n")
+    return lambda: tail(path, 5, "error")
+
+def _api_benchmark(route: str):
+    def setup(fixture: Fixture):
+        url, session = fixture.api()
+
+        async def request() -> None:
+            async with session.get(f"{url}{route}") as response:
+                await response.read()
+        return lambda: fixture.run(request())
+    return setup
+
+benchmark("api.where_next")(_api_benchmark("/where_next?group_id=1&plan_name=plan0"))
+benchmark("api.get_plan")(_api_benchmark("/get_plan?group_id=1&plan_name=plan0"))
+
+def measure(func: Callable[[], object], repeat: int, min_time: float) -> dict:
+    """ Seconds per call of repeat samples, each running at least min_time """
+    timer = timeit.Timer(func)
+    loops = 1
+    while loops * timer.timeit(1) < min_time and loops < 1_000_000:
+        loops *= 10
+    samples = [timer.timeit(loops) / loops for _ in range(repeat)]
+    return {"median": statistics.median(samples), "min": min(samples), "loops": loops}
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """ Print results next to the baseline, returns names of regressed benchmarks """
+    regressions = []
+    print(f"{'benchmark':<34}{'time':>12}{'median':>12}{'baseline':>12}{'change':>9}")
+    for name, result in results.items():
+        old = baseline.get(name, None)
+        line = f"{name:<34}{format_seconds(result['min']):>12}" \
+               f"{format_seconds(result['median']):>12}"
+        if old is not None:
+            change = result["min"] / old["min"] - 1
+            line += f"{format_seconds(old['min']):>12}{change:>+9.0%}"
+            if change > tolerance:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+def format_seconds(seconds: float) -> str:
+    """ Human readable duration """
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+def main() -> None:
+    """ Parse arguments, run the benchmarks and compare them with the baseline """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only run benchmarks containing the text")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per sample")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, 0.25 is 25 %%")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    fixture = Fixture()
+    results = {}
+    try:
+        for name, setup in BENCHMARKS.items():
+            if args.filter not in name:
+                continue
+            func = setup(fixture)
+            result = measure(func, args.repeat, args.min_time)
+            old = baseline.get(name, None)
+            if old is not None and result["min"] > old["min"] * (1 + args.tolerance):
+                retry = measure(func, args.repeat, args.min_time)
+                result = min(result, retry, key=lambda item: item["min"])
+            results[name] = result
+    finally:
+        fixture.close()
+
+    report = {"python": sys.version.split()[0], "machine": platform.machine(),
+              "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    regressions = compare(results, baseline, args.tolerance)
+    if args.update_baseline:
+        if os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                report["results"] = {**json.load(f)["results"], **results}
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline written to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} benchmarks slower than the baseline")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+""" Ordering check and throughput of concurrent update processing
+
+Usage: python -m benchmarks.update_order [--chats <n>] [--updates <n>] [--latency <ms>]
+
+Feeds updates of several chats through an Application the way its update
+fetcher does, every handler waits --latency ms like a slow request would.
+Fails if updates of a chat ran out of order, overlapped, or if more handlers
+ran at once than the limit. Compares sequential processing with
+ChatOrderedProcessor for a few limits.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+from telegram import Chat, Message, Update, User
+from telegram.ext import Application, ContextTypes, TypeHandler
+from dsb.utils.update_processor import ChatOrderedProcessor
+
+def make_updates(chats: int, total: int) -> list[Update]:
+    """ Updates spread randomly over the chats, message ids count up per chat """
+    counters = [0] * chats
+    updates = []
+    rng = random.Random(0)
+    for update_id in range(total):
+        chat = rng.randrange(chats)
+        counters[chat] += 1
+        message = Message(counters[chat], datetime.now(), Chat(chat, Chat.GROUP),
+                          from_user=User(chat, "user", False), text="text")
+        updates.append(Update(update_id, message=message))
+    return updates
+
+class Recorder: # pylint: disable=R0903
+    """ Handler remembering the order and overlap of processed updates """
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.last: dict[int, int] = {}
+        self.active_chats: set[int] = set()
+        self.running = 0
+        self.peak = 0
+        self.errors: list[str] = []
+
+    async def __call__(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        chat, message_id = update.effective_chat.id, update.effective_message.message_id
+        if chat in self.active_chats:
+            self.errors.append(f"chat {chat}: message {message_id} overlapped the previous one")
+        if message_id != self.last.get(chat, 0) + 1:
+            self.errors.append(f"chat {chat}: message {message_id} after {self.last.get(chat)}")
+        self.active_chats.add(chat)
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        self.running -= 1
+        self.active_chats.discard(chat)
+        self.last[chat] = message_id
+
+async def run(updates: list[Update], limit: int, latency: float) -> tuple[float, Recorder]:
+    """ Process the updates, limit 1 processes them one by one like run_polling does """
+    builder = Application.builder().token("1:benchmark").updater(None)
+    if limit > 1:
+        builder.concurrent_updates(ChatOrderedProcessor(limit))
+    app = builder.build()
+    # skip getMe, nothing here talks to the Bot API
+    app.bot._bot_user = User(1, "bot", True, username="dsb_bot")  # pylint: disable=protected-access
+    app.bot._initialized = True  # pylint: disable=protected-access
+    await app.initialize()
+    recorder = Recorder(latency)
+    app.add_handler(TypeHandler(Update, recorder))
+    processor = app.update_processor
+    start = time.perf_counter()
+    if limit > 1:
+        await asyncio.gather(*(asyncio.create_task(
+            processor.process_update(update, app.process_update(update)))
+            for update in updates))
+    else:
+        for update in updates:
+            await app.process_update(update)
+    elapsed = time.perf_counter() - start
+    await app.shutdown()
+    if recorder.peak > limit:
+        recorder.errors.append(f"{recorder.peak} handlers ran at once, limit is {limit}")
+    return elapsed, recorder
+
+def main() -> None:
+    """ Parse arguments and print the results """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=20, help="handler latency in ms")
+    parser.add_argument("--limits", type=int, nargs="+", default=[1, 4, 16, 64])
+    args = parser.parse_args()
+
+    updates = make_updates(args.chats, args.updates)
+    failed = False
+    print(f"{args.updates} updates in {args.chats} chats, {args.latency:.0f} ms per handler")
+    for limit in args.limits:
+        elapsed, recorder = asyncio.run(run(updates, limit, args.latency / 1000))
+        status = "ok" if not recorder.errors else f"{len(recorder.errors)} errors"
+        print(f"limit {limit:>3}: {args.updates / elapsed:8.1f} updates/s, "
+              f"peak {recorder.peak:>3} running, {status}")
+        for error in recorder.errors[:5]:
+            print(f"  {error}")
+        failed = failed or bool(recorder.errors)
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
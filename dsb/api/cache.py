@@ -0,0 +1,91 @@
+""" Cache of decoded chat data for the api """
+
+import gzip
+import hashlib
+from collections import OrderedDict
+from dsb.data.database import Database
+from dsb.types.plan import Plan
+
+class PlanSnapshot:
+    """ Serialized plan together with its content hash """
+    def __init__(self, plan: Plan) -> None:
+        self._payload = plan.to_json()
+        self._etag = hashlib.sha1(self._payload).hexdigest()
+        self._gzipped = None
+
+    @property
+    def etag(self) -> str:
+        """ Returns the content hash of the plan """
+        return self._etag
+
+    @property
+    def payload(self) -> bytes:
+        """ Returns the plan serialized to json """
+        return self._payload
+
+    @property
+    def gzipped(self) -> bytes:
+        """ Returns the gzip compressed payload """
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self._payload)
+        return self._gzipped
+
+class ChatEntry: # pylint: disable=R0903
+    """ Decoded chat data valid for a single version of the chat file """
+    def __init__(self, version: tuple[int, int] | None, data: dict) -> None:
+        self.version = version
+        self.plans: dict[str, Plan] = data.get("plans", {}) if data else {}
+        self.snapshots: dict[str, PlanSnapshot] = {}
+
+class ChatCache:
+    """ LRU cache keeping decoded chat data until the underlying file changes
+
+    Lookups only stat the chat file, the file is decoded again only if its
+    modification time or size changed. Outdated entries are dropped when
+    looked up, the least recently used chats once there are more than
+    max_entries. Entries are stored by the caller's thread, decoding is meant
+    to run on a worker pool via `load`.
+    """
+    def __init__(self, database: Database, max_entries: int = 256) -> None:
+        self._database = database
+        self._max_entries = max_entries
+        self._entries: OrderedDict[int, ChatEntry] = OrderedDict()
+
+    def get(self, chat_id: int) -> ChatEntry | None:
+        """ Get cached entry if it is still up to date """
+        entry = self._entries.get(chat_id, None)
+        if entry is None:
+            return None
+        if entry.version != self._database.get_chat_data_version(chat_id):
+            del self._entries[chat_id]
+            return None
+        self._entries.move_to_end(chat_id)
+        return entry
+
+    def load(self, chat_id: int) -> ChatEntry:
+        """ Decode the chat file, safe to call from any thread """
+        version = self._database.get_chat_data_version(chat_id)
+        return ChatEntry(version, self._database.get_chat_data(chat_id))
+
+    def store(self, chat_id: int, entry: ChatEntry) -> None:
+        """ Store freshly loaded entry, evicting the least recently used ones """
+        self._entries[chat_id] = entry
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, chat_id: int) -> None:
+        """ Drop the cached entry of a chat """
+        self._entries.pop(chat_id, None)
+
+    @staticmethod
+    def snapshot(entry: ChatEntry, plan_name: str) -> PlanSnapshot | None:
+        """ Get serialized plan, serializing it only once per chat file version """
+        snapshot = entry.snapshots.get(plan_name, None)
+        if snapshot is None:
+            plan = entry.plans.get(plan_name, None)
+            if not isinstance(plan, Plan):
+                return None
+            snapshot = PlanSnapshot(plan)
+            entry.snapshots[plan_name] = snapshot
+        return snapshot
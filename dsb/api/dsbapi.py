@@ -1,38 +1,119 @@
 """ Api for DSB """
 
+import asyncio
 import threading
-from flask import Flask, request, jsonify, abort
-import jsonpickle
-from werkzeug.serving import make_server
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from dsb.api.cache import ChatCache, ChatEntry
+from dsb.api.events import EventHub
+from dsb.api.webhook import WebhookReceiver
 from dsb.types.plan import Plan, Lesson
 from dsb.utils.transforms import str_to_day
+from dsb.utils.render_cache import RenderCache, RENDER_PROFILES, CONTENT_TYPES
+from dsb.utils.metrics import REGISTRY
 from dsb.data.database import Database
 
 class DSBApiThread(threading.Thread):
-    """ Api server thread"""
-    def __init__(self, database: Database, api_port: int) -> None:
-        """ Initialize the api """
-        threading.Thread.__init__(self)
-        self._app = Flask(__name__)
-        self.__setup_routes()
+    """ Api server thread """
+    def __init__(self, database: Database, api_port: int, workers: int = 8,
+                 render_cache: RenderCache | None = None) -> None:
+        """ Initialize the api
+
+        Requests are handled concurrently on the thread's own event loop,
+        blocking work (reading chat files) runs on a pool of `workers` threads.
+        """
+        threading.Thread.__init__(self, name="dsb-api", daemon=True)
         self._database = database
-        self.server = make_server('0.0.0.0', api_port, self._app)
-        self.ctx = self._app.app_context()
-        self.ctx.push()
+        self._cache = ChatCache(database)
+        self._render_cache = render_cache if render_cache is not None else RenderCache()
+        self._events = EventHub(self._get_chat)
+        self._port = int(api_port)
+        self._executor = ThreadPoolExecutor(max_workers=int(workers),
+                                            thread_name_prefix="dsb-api-worker")
+        self._loop = asyncio.new_event_loop()
+        self._stop_event = asyncio.Event()
+        self.ready = threading.Event()
+        self._app = web.Application()
+        self.__setup_routes()
 
     def __setup_routes(self):
-        self._app.add_url_rule("/where_next", view_func=self.where_next, methods=["GET"])
-        self._app.add_url_rule("/add_lesson", view_func=self.add_lesson, methods=["POST"])
-        self._app.add_url_rule("/edit_lesson", view_func=self.edit_lesson, methods=["POST"])
-        self._app.add_url_rule("/get_plan", view_func=self.get_plan, methods=["GET"])
+        self._app.router.add_get("/where_next", self.where_next)
+        self._app.router.add_post("/add_lesson", self.add_lesson)
+        self._app.router.add_post("/edit_lesson", self.edit_lesson)
+        self._app.router.add_get("/get_plan", self.get_plan)
+        self._app.router.add_post("/batch", self.batch)
+        self._app.router.add_get("/plan_image", self.plan_image)
+        self._app.router.add_get("/events", self.events)
+        self._app.router.add_get("/metrics", self.metrics)
+        self._queries = {
+            "where_next": self._query_where_next,
+            "where_now": self._query_where_now,
+            "status": self._query_status,
+            "get_plan": self._query_get_plan,
+        }
+
+    def add_webhook(self, receiver: WebhookReceiver) -> None:
+        """ Serve the Telegram webhook on the api port, has to be called before start """
+        receiver.add_routes(self._app)
 
     def run(self):
         """ Run the api """
-        self.server.serve_forever()
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_until_complete(self.__serve())
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._loop.close()
+
+    async def __serve(self) -> None:
+        """ Serve requests until shutdown is requested """
+        runner = web.AppRunner(self._app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "0.0.0.0", self._port)
+        await site.start()
+        self._events.start()
+        self.ready.set()
+        try:
+            await self._stop_event.wait()
+        finally:
+            await self._events.close()
+            await runner.cleanup()
 
     def shutdown(self):
         """ Shutdown the api """
-        self.server.shutdown()
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+
+    def notify_chat_changed(self, chat_id: int) -> None:
+        """ Let event subscribers know chat data was saved, safe to call from any thread """
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._events.chat_changed, chat_id)
+
+    async def _run_blocking(self, func, *args):
+        """ Run blocking function on the worker pool """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _get_chat_id(data) -> int:
+        """ Get group id from request data """
+        chat_id = data.get("group_id")
+        if not chat_id:
+            raise web.HTTPBadRequest(text="Group id not specified")
+        try:
+            return int(chat_id)
+        except ValueError as exc:
+            raise web.HTTPBadRequest(text="Group id has to be a number") from exc
+
+    @staticmethod
+    def _get_plan_name(data) -> str:
+        """ Get plan name from request data """
+        plan_name = data.get("plan_name")
+        if not plan_name:
+            raise web.HTTPBadRequest(text="Plan name not specified")
+        return plan_name
 
     def load_plan(self, chat_id: int, plan_name: str) -> Plan:
         """ Get plan from database """
@@ -44,53 +125,155 @@ class DSBApiThread(threading.Thread):
             raise ValueError("Chat data is empty")
         return plan
 
-    def where_next(self):
+    async def _load_plan(self, chat_id: int, plan_name: str) -> Plan:
+        """ Get plan from database without blocking the event loop """
+        try:
+            return await self._run_blocking(self.load_plan, chat_id, plan_name)
+        except ValueError as e:
+            raise web.HTTPNotFound(text=str(e)) from e
+
+    async def _get_chat(self, chat_id: int) -> ChatEntry:
+        """ Get cached chat data, decoding the chat file only if it changed """
+        entry = self._cache.get(chat_id)
+        if entry is None:
+            entry = await self._run_blocking(self._cache.load, chat_id)
+            self._cache.store(chat_id, entry)
+        return entry
+
+    async def _get_cached_plan(self, chat_id: int, plan_name: str) -> Plan:
+        """ Get read-only plan from the chat cache """
+        entry = await self._get_chat(chat_id)
+        plan = entry.plans.get(plan_name, None)
+        if not isinstance(plan, Plan):
+            raise web.HTTPNotFound(text="Plan not found")
+        return plan
+
+    @staticmethod
+    def _plan_from_entry(entry: ChatEntry, query) -> Plan:
+        """ Get plan named in the query from chat entry """
+        plan_name = DSBApiThread._get_plan_name(query)
+        plan = entry.plans.get(plan_name, None)
+        if not isinstance(plan, Plan):
+            raise web.HTTPNotFound(text="Plan not found")
+        return plan
+
+    def _query_where_next(self, entry: ChatEntry, query, now: datetime) -> dict:
+        """ Room of the next lesson """
+        lesson = self._plan_from_entry(entry, query).next_lesson_at(now)
+        if not lesson:
+            raise web.HTTPNotFound(text="No next lesson")
+        seconds = (datetime.combine(now.date(), lesson.start_time) - now).total_seconds()
+        return {"room": lesson.room, "subject": lesson.subject, "starts_in": int(seconds)}
+
+    def _query_where_now(self, entry: ChatEntry, query, now: datetime) -> dict:
+        """ Room of the current lesson """
+        lesson = self._plan_from_entry(entry, query).current_lesson_at(now)
+        if not lesson:
+            raise web.HTTPNotFound(text="No lesson now")
+        seconds = (datetime.combine(now.date(), lesson.end_time) - now).total_seconds()
+        return {"room": lesson.room, "subject": lesson.subject, "ends_in": int(seconds)}
+
+    def _query_status(self, entry: ChatEntry, _, now: datetime) -> dict:
+        """ Free and busy students of every plan in the group """
+        if not entry.plans:
+            raise web.HTTPNotFound(text="No plans found")
+        free, busy = [], []
+        for plan_name, plan in entry.plans.items():
+            if not isinstance(plan, Plan):
+                continue
+            lesson = plan.current_lesson_at(now)
+            if lesson is None:
+                next_lesson = plan.next_lesson_at(now)
+                starts_in = None
+                if next_lesson is not None:
+                    starts_in = int((datetime.combine(now.date(), next_lesson.start_time) -
+                                     now).total_seconds())
+                free.extend({"student": student, "plan": plan_name, "starts_in": starts_in}
+                            for student in plan.students)
+                continue
+            ends_in = int((datetime.combine(now.date(), lesson.end_time) - now).total_seconds())
+            busy.extend({"student": student, "plan": plan_name, "subject": lesson.subject,
+                         "type": lesson.type, "ends_in": ends_in}
+                        for student in plan.students)
+        return {"free": free, "busy": busy}
+
+    def _query_get_plan(self, entry: ChatEntry, query, _: datetime) -> dict:
+        """ All lessons of the plan """
+        return self._plan_from_entry(entry, query).to_dict()
+
+    async def where_next(self, request: web.Request) -> web.Response:
         """ Returns classroom where the user has lessons in next """
-        chat_id = int(request.args.get("group_id"))
-        if chat_id is None:
-            return abort(400, "Group id not specified")
-        plan_name = request.args.get("plan_name")
-        if plan_name is not None:
-            try:
-                plan = self.load_plan(chat_id, plan_name)
-            except ValueError as e:
-                return abort(404, str(e))
-        else:
-            return abort(400, "Plan name was not specified")
+        chat_id = self._get_chat_id(request.query)
+        plan_name = request.query.get("plan_name")
+        if not plan_name:
+            raise web.HTTPBadRequest(text="Plan name was not specified")
+        plan = await self._get_cached_plan(chat_id, plan_name)
         lesson = plan.next_lesson
         if not lesson:
-            return abort(404, "No next lesson")
-        return jsonify({"room": lesson.room})
+            raise web.HTTPNotFound(text="No next lesson")
+        return web.json_response({"room": lesson.room})
+
+    async def batch(self, request: web.Request) -> web.Response:
+        """ Evaluate many queries against a single moment in time
+
+        Expects json body {"queries": [{"query": <name>, "group_id": ..., ...}, ...]},
+        results are returned in the same order. Each chat file is loaded once.
+        """
+        try:
+            body = await request.json()
+            queries = body["queries"]
+            if not isinstance(queries, list):
+                raise TypeError
+        except (ValueError, KeyError, TypeError) as exc:
+            raise web.HTTPBadRequest(text="Expected json object with a list of queries") from exc
 
-    def add_lesson(self):
+        chat_ids = set()
+        for query in queries:
+            try:
+                chat_ids.add(self._get_chat_id(query))
+            except (web.HTTPBadRequest, AttributeError):
+                continue
+        entries = dict(zip(chat_ids, await asyncio.gather(*(self._get_chat(chat_id)
+                                                             for chat_id in chat_ids))))
+
+        now = datetime.now()
+        results = []
+        for query in queries:
+            try:
+                if not isinstance(query, dict):
+                    raise web.HTTPBadRequest(text="Query has to be an object")
+                handler = self._queries.get(query.get("query"), None)
+                if handler is None:
+                    raise web.HTTPBadRequest(text=f"Unknown query {query.get('query')}")
+                entry = entries[self._get_chat_id(query)]
+                results.append({"status": 200, "data": handler(entry, query, now)})
+            except web.HTTPException as e:
+                results.append({"status": e.status, "error": e.text})
+        return web.json_response({"time": now.isoformat(), "results": results})
+
+    async def add_lesson(self, request: web.Request) -> web.Response:
         """ Add a lesson to a plan """
-        data = request.form.to_dict()
+        data = dict(await request.post())
         required = ["group_id", "plan_name", "day", "start",
                     "end", "teacher", "room", "repeat", "subject", "type"]
         for req in required:
             if req not in data:
-                return abort(400, f"{req} missing")
+                raise web.HTTPBadRequest(text=f"{req} missing")
         new_lesson = Lesson(data)
-        chat_id = int(data["chat_id"])
-        try:
-            plan = self.load_plan(chat_id, data["plan_name"])
-        except ValueError as e:
-            return abort(404, str(e))
+        chat_id = self._get_chat_id(data)
+        plan = await self._load_plan(chat_id, data["plan_name"])
         plan.add_lesson(str_to_day(data["day"]) - 1, new_lesson)
-        return "Lesson added", 200
+        return web.Response(text="Lesson added")
 
-    def edit_lesson(self):
+    async def edit_lesson(self, request: web.Request) -> web.Response:
         """ Edit lesson from a specified plan """
-        data = request.form.to_dict()
+        data = dict(await request.post())
         required = ["group_id", "day", "plan_name", "idx"]
         for req in required:
             if req not in data:
-                return abort(400, f"{req} missing")
-        chat_id = int(data["group_id"])
-        try:
-            plan = self.load_plan(chat_id, data["plan_name"])
-        except ValueError as e:
-            return abort(404, str(e))
+                raise web.HTTPBadRequest(text=f"{req} missing")
+        chat_id = self._get_chat_id(data)
+        plan = await self._load_plan(chat_id, data["plan_name"])
         day = str_to_day(data["day"]) - 1
         idx = int(data["idx"])
         lesson = plan.get_day(day)[idx]
@@ -99,23 +282,104 @@ class DSBApiThread(threading.Thread):
         new_lesson = Lesson(lesson_data)
         plan.remove_lesson_by_index(day, idx)
         plan.add_lesson(day, new_lesson)
-        return "Lesson changed", 200
+        return web.Response(text="Lesson changed")
 
-    def get_plan(self):
-        """ Get a plan from the database """
-        data = request.args.to_dict()
-        chat_id = int(data.get("group_id"))
-        if not chat_id:
-            return abort(400, "Group id not specified")
-        plan_name = request.args.get("plan_name")
-        if not plan_name:
-            return abort(400, "Plan name not specified")
+    async def get_plan(self, request: web.Request) -> web.Response:
+        """ Get a plan from the database
+
+        Responds with an ETag (content hash of the plan), answers matching
+        If-None-Match with 304 and sends the payload gzipped when accepted.
+        """
+        chat_id = self._get_chat_id(request.query)
+        plan_name = self._get_plan_name(request.query)
+        entry = await self._get_chat(chat_id)
+        snapshot = self._cache.snapshot(entry, plan_name)
+        if snapshot is None:
+            raise web.HTTPNotFound(text="Plan not found")
+        headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.if_none_match or ()
+        if any(tag.value in (snapshot.etag, "*") for tag in if_none_match):
+            response = web.Response(status=304, headers=headers)
+        elif "gzip" in request.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            response = web.Response(body=snapshot.gzipped, headers=headers,
+                                    content_type="application/json")
+        else:
+            response = web.Response(body=snapshot.payload, headers=headers,
+                                    content_type="application/json")
+        response.etag = snapshot.etag
+        return response
+
+    async def plan_image(self, request: web.Request) -> web.StreamResponse:
+        """ Get an image of the plan
+
+        Images come from the shared render cache, on a miss the plan is rendered
+        on the render thread. Query parameter `profile` selects size and format.
+        """
+        chat_id = self._get_chat_id(request.query)
+        plan_name = self._get_plan_name(request.query)
+        profile = request.query.get("profile", "full")
+        if profile not in RENDER_PROFILES:
+            raise web.HTTPBadRequest(
+                text=f"Unknown profile, use one of: {', '.join(RENDER_PROFILES)}")
+        entry = await self._get_chat(chat_id)
+        snapshot = self._cache.snapshot(entry, plan_name)
+        if snapshot is None:
+            raise web.HTTPNotFound(text="Plan not found")
+        plan = entry.plans[plan_name]
+        if plan.is_empty():
+            raise web.HTTPNotFound(text="Plan is empty")
+
+        content_hash, _, _, parity = RenderCache.key(snapshot.etag, plan_name, profile)
+        etag = f"{content_hash}-{profile}-{parity}"
+        headers = {"Cache-Control": "public, max-age=60"}
+        if any(tag.value in (etag, "*") for tag in request.if_none_match or ()):
+            response = web.Response(status=304, headers=headers)
+            response.etag = etag
+            return response
+
+        image = await self._render_cache.render_async(plan, plan_name, profile, snapshot.etag)
+        headers["Content-Type"] = CONTENT_TYPES[RENDER_PROFILES[profile]["image_format"]]
+        response = web.StreamResponse(headers=headers)
+        response.etag = etag
+        response.content_length = len(image)
+        await response.prepare(request)
+        await self.__write_chunks(response, image)
+        return response
+
+    @staticmethod
+    async def __write_chunks(response: web.StreamResponse, data: bytes,
+                             chunk_size: int = 64 * 1024) -> None:
+        """ Write data in chunks without copying it and finish the response """
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            await response.write(view[start:start + chunk_size])
+        await response.write_eof()
+
+    async def metrics(self, _: web.Request) -> web.Response:
+        """ Handler, persistence, rendering and Bot API metrics in prometheus format """
+        return web.Response(body=REGISTRY.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def events(self, request: web.Request) -> web.StreamResponse:
+        """ Server-sent events with lesson starts/ends and plan changes of a group """
+        chat_id = self._get_chat_id(request.query)
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream",
+                                               "Cache-Control": "no-cache",
+                                               "X-Accel-Buffering": "no"})
+        await response.prepare(request)
+        queue = None
         try:
-            plan = self.load_plan(chat_id, data["plan_name"])
-        except ValueError as e:
-            return abort(404, str(e))
-        plan_dict = {}
-        for i in range(0, 5):
-            day = plan.get_day(i)
-            plan_dict[i] = [lesson.to_dict() for lesson in day]
-        return jsonify(plan_dict)
+            queue = await self._events.subscribe(chat_id)
+            await response.write(b": subscribed\n\n")
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+                await response.write(message)
+        except ConnectionResetError:
+            pass
+        finally:
+            if queue is not None:
+                self._events.unsubscribe(chat_id, queue)
+        return response
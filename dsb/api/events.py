@@ -0,0 +1,219 @@
+""" Lesson start/end event stream for the api """
+
+import json
+import heapq
+import asyncio
+import logging
+import itertools
+from datetime import datetime
+from typing import Awaitable, Callable
+from dsb.api.cache import ChatEntry
+from dsb.types.lesson import Lesson
+from dsb.types.plan import Plan
+from dsb.utils.scheduler import wait_for_wakeup
+
+class ChatSubscription: # pylint: disable=R0903
+    """ Subscribers and tracked plans of a single chat """
+    def __init__(self) -> None:
+        self.queues: set[asyncio.Queue] = set()
+        self.hashes: dict[str, str] = {}
+        self.generation = 0
+
+class EventHub:
+    """ Pushes lesson transitions and plan changes to subscribers
+
+    A single task sleeps until the earliest upcoming transition of any
+    subscribed plan, subscribers only wait on their queues, so idle
+    subscribers cost no wakeups apart from the periodic keepalive.
+    Has to be used from the event loop of the api.
+    """
+    def __init__(self, load_chat: Callable[[int], Awaitable[ChatEntry]],
+                 keepalive: float = 30, queue_size: int = 100,
+                 logger: logging.Logger | None = None) -> None:
+        self._load_chat = load_chat
+        self._logger = logger or logging.getLogger("DSB")
+        self._keepalive = keepalive
+        self._queue_size = queue_size
+        self._chats: dict[int, ChatSubscription] = {}
+        self._heap: list[tuple[datetime, int, int, str, int]] = []
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    @property
+    def subscribers(self) -> int:
+        """ Returns the number of connected subscribers """
+        return sum(len(chat.queues) for chat in self._chats.values())
+
+    def start(self) -> None:
+        """ Start the timer task """
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.__run())
+
+    async def close(self) -> None:
+        """ Stop the timer and disconnect every subscriber """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in self._running:
+            task.cancel()
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+        for chat in self._chats.values():
+            for queue in chat.queues:
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+        self._chats.clear()
+        self._heap.clear()
+
+    async def subscribe(self, chat_id: int) -> asyncio.Queue:
+        """ Subscribe to events of a chat, the queue yields encoded events and None on close """
+        queue = asyncio.Queue(self._queue_size)
+        chat = self._chats.get(chat_id, None)
+        if chat is None:
+            chat = ChatSubscription()
+            self._chats[chat_id] = chat
+            chat.queues.add(queue)
+            try:
+                entry = await self._load_chat(chat_id)
+            except BaseException:
+                self.unsubscribe(chat_id, queue)
+                raise
+            self.__track(chat_id, chat, entry)
+        else:
+            chat.queues.add(queue)
+        return queue
+
+    def unsubscribe(self, chat_id: int, queue: asyncio.Queue) -> None:
+        """ Remove the subscriber, chats without subscribers stop being tracked """
+        chat = self._chats.get(chat_id, None)
+        if chat is None:
+            return
+        chat.queues.discard(queue)
+        if not chat.queues:
+            self._chats.pop(chat_id, None)
+
+    def chat_changed(self, chat_id: int) -> None:
+        """ Reload plans of the chat if anyone is subscribed to it """
+        if chat_id in self._chats:
+            task = asyncio.get_running_loop().create_task(self.__reload(chat_id))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def __reload(self, chat_id: int) -> None:
+        """ Announce plan changes and reschedule transitions of the chat """
+        try:
+            entry = await self._load_chat(chat_id)
+        except Exception as e: # pylint: disable=W0718
+            self._logger.error("Could not reload plans of chat %s for events: %s", chat_id, e)
+            return
+        chat = self._chats.get(chat_id, None)
+        if chat is None:
+            return
+        old_hashes = chat.hashes
+        self.__track(chat_id, chat, entry)
+        for plan_name in old_hashes.keys() | chat.hashes.keys():
+            old_hash = old_hashes.get(plan_name, None)
+            new_hash = chat.hashes.get(plan_name, None)
+            if old_hash == new_hash:
+                continue
+            if new_hash is None:
+                change = "removed"
+            elif old_hash is None:
+                change = "added"
+            else:
+                change = "changed"
+            self.__publish(chat, "plan_changed", {"plan_name": plan_name, "change": change})
+
+    def __track(self, chat_id: int, chat: ChatSubscription, entry: ChatEntry) -> None:
+        """ Remember plan hashes and schedule the next transition of every plan """
+        chat.generation = next(self._counter)
+        chat.hashes = {}
+        tracked = sum(len(other.hashes) for other in self._chats.values())
+        if len(self._heap) > 2 * tracked + 64:
+            self._heap = [item for item in self._heap if item[2] in self._chats and
+                          self._chats[item[2]].generation == item[4]]
+            heapq.heapify(self._heap)
+        now = datetime.now()
+        for plan_name, plan in entry.plans.items():
+            if not isinstance(plan, Plan):
+                continue
+            chat.hashes[plan_name] = plan.content_hash()
+            self.__schedule(chat_id, chat, plan_name, plan, now)
+
+    def __schedule(self, chat_id: int, chat: ChatSubscription, plan_name: str,
+                   plan: Plan, after: datetime) -> None:
+        """ Push the next transition of the plan to the timer heap """
+        transition = plan.next_transition_at(after)
+        if transition is None:
+            return
+        entry = (transition[0], next(self._counter), chat_id, plan_name, chat.generation)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    async def __run(self) -> None:
+        """ Sleep until the earliest transition and publish due events """
+        last_keepalive = asyncio.get_running_loop().time()
+        while True:
+            timeout = self._keepalive
+            if self._heap:
+                timeout = min(timeout, (self._heap[0][0] - datetime.now()).total_seconds())
+            await wait_for_wakeup(self._wakeup, timeout)
+            now = datetime.now()
+            while self._heap and self._heap[0][0] <= now:
+                when, _, chat_id, plan_name, generation = heapq.heappop(self._heap)
+                try:
+                    await self.__fire(when, chat_id, plan_name, generation)
+                except Exception as e: # pylint: disable=W0718
+                    self._logger.error("Could not publish events of %s in chat %s: %s",
+                                       plan_name, chat_id, e)
+            if asyncio.get_running_loop().time() - last_keepalive >= self._keepalive:
+                last_keepalive = asyncio.get_running_loop().time()
+                for chat in self._chats.values():
+                    for queue in chat.queues:
+                        self.__put(queue, b": keepalive\n\n")
+
+    async def __fire(self, when: datetime, chat_id: int, plan_name: str, generation: int) -> None:
+        """ Publish the transition and schedule the following one """
+        chat = self._chats.get(chat_id, None)
+        if chat is None or chat.generation != generation:
+            return
+        entry = await self._load_chat(chat_id)
+        plan = entry.plans.get(plan_name, None)
+        if not isinstance(plan, Plan) or chat.generation != generation:
+            return
+        for moment, kind, lesson in self.__transitions_at(plan, when):
+            self.__publish(chat, kind, {"plan_name": plan_name, "time": moment.isoformat(),
+                                        "subject": lesson.subject, "room": lesson.room,
+                                        "type": lesson.type})
+        self.__schedule(chat_id, chat, plan_name, plan, when)
+
+    @staticmethod
+    def __transitions_at(plan: Plan, when: datetime) -> list[tuple[datetime, str, Lesson]]:
+        """ All transitions of the plan happening exactly at the given moment """
+        transitions = []
+        for lesson in plan.get_day(when.weekday()) if when.weekday() < 5 else []:
+            if not lesson.active_at(when):
+                continue
+            if lesson.end_time == when.time():
+                transitions.append((when, "lesson_end", lesson))
+            if lesson.start_time == when.time():
+                transitions.append((when, "lesson_start", lesson))
+        return transitions
+
+    def __publish(self, chat: ChatSubscription, event: str, data: dict) -> None:
+        """ Send encoded event to every subscriber of the chat """
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        for queue in chat.queues:
+            self.__put(queue, message)
+
+    @staticmethod
+    def __put(queue: asyncio.Queue, message: bytes | None) -> None:
+        """ Queue the message, dropping it for subscribers that do not keep up """
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
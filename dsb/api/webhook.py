@@ -0,0 +1,72 @@
+""" Webhook endpoint receiving updates from Telegram """
+
+import hmac
+import json
+from typing import Callable
+from aiohttp import web
+from dsb.utils.metrics import REGISTRY
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookReceiver:
+    """ Accepts updates POSTed by Telegram and hands them to the bot
+
+    Requests without the secret token set with setWebhook are rejected, the
+    update is only decoded here, `deliver` is called with the parsed JSON and
+    has to be safe to call from the thread serving the request. The endpoint
+    can be added to the api server or served on its own port, behind a reverse
+    proxy terminating TLS in both cases.
+    """
+    def __init__(self, secret: str, path: str = "/telegram") -> None:
+        self.secret = secret
+        self.path = "/" + path.strip("/")
+        self._deliver: Callable[[dict], None] | None = None
+        self._runner: web.AppRunner | None = None
+
+    def attach(self, deliver: Callable[[dict], None] | None) -> None:
+        """ Start passing updates to deliver, None answers 503 until attached again """
+        self._deliver = deliver
+
+    def add_routes(self, app: web.Application) -> None:
+        """ Serve the endpoint from the web application """
+        app.router.add_post(self.path, self.handle)
+
+    async def start(self, listen: str, port: int) -> None:
+        """ Serve the endpoint on its own port """
+        app = web.Application()
+        self.add_routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, listen, port).start()
+
+    async def stop(self) -> None:
+        """ Stop serving the endpoint started with start """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    @staticmethod
+    def __count(result: str) -> None:
+        REGISTRY.counter("dsb_webhook_requests_total", "Webhook requests by result",
+                         result=result).inc()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """ Validate the secret and pass the update on """
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.__count("forbidden")
+            raise web.HTTPForbidden(text="Invalid secret token")
+        if self._deliver is None:
+            self.__count("unavailable")
+            raise web.HTTPServiceUnavailable(text="Bot is not running")
+        try:
+            data = json.loads(await request.read())
+        except (json.JSONDecodeError, UnicodeDecodeError) as exc:
+            self.__count("invalid")
+            raise web.HTTPBadRequest(text="Invalid update") from exc
+        if not isinstance(data, dict):
+            self.__count("invalid")
+            raise web.HTTPBadRequest(text="Invalid update")
+        self._deliver(data)
+        self.__count("ok")
+        return web.Response()
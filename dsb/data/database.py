@@ -2,6 +2,7 @@
 
 import os
 import jsonpickle
+from dsb.data.image_store import ImageStore, ImageWriter
 
 class Database:
     """ Class for handling the persistance data """
@@ -9,6 +10,7 @@ class Database:
         """ Initialize the database """
         self._path = path
         self.__setup()
+        self.images = ImageStore(path)
 
     def __setup(self) -> None:
         """ Create the directories for the database """
@@ -28,6 +30,14 @@ class Database:
         except FileNotFoundError:
             return {}
 
+    def get_chat_data_version(self, chat_id: int) -> tuple[int, int] | None:
+        """ Get the modification time and size of the chat data file """
+        try:
+            stat = os.stat(f"{self._path}/chat_data/{chat_id}.json")
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
     def get_user_data(self, user_id: int) -> dict:
         """ Get the user data """
         try:
@@ -66,22 +76,29 @@ class Database:
         with open(f"{self._path}/files/{file_name}.json", "w", encoding='utf-8') as f:
             f.write(jsonpickle.encode(data, keys=True, indent=4))
 
-    def get_image(self, group_id: int, file_name: str) -> bytes:
+    def get_image(self, digest: str) -> bytes:
         """ Get the image data """
         try:
-            with open(f"{self._path}/{group_id}/images/{file_name}.jpg", "rb") as f:
-                data = f.read()
-                if data is None:
-                    return b""
-                return data
+            with open(self.image_path(digest), "rb") as f:
+                return f.read()
         except FileNotFoundError:
             return b""
 
-    def save_image(self, group_id: int, file_name: str, data: bytes) -> None:
-        """ Save the image data """
-        os.makedirs(f"{self._path}/{group_id}/images", exist_ok=True)
-        with open(f"{self._path}/{group_id}/images/{file_name}.jpg", "wb") as f:
-            f.write(data)
+    def image_path(self, digest: str) -> str:
+        """ Get path of the stored image """
+        return self.images.path(digest)
+
+    def image_writer(self) -> ImageWriter:
+        """ Get temporary file to stream a new image into, finish with save_image """
+        return self.images.writer()
+
+    def save_image(self, group_id: int, set_name: str, data: bytes | ImageWriter) -> str:
+        """ Save the image to a set, returns its digest """
+        if not isinstance(data, ImageWriter):
+            writer = self.image_writer()
+            writer.write(data)
+            data = writer
+        return self.images.add(group_id, set_name, data)
 
     def delete_json(self, file_name: str) -> None:
         """ Delete the file data """
@@ -92,14 +109,17 @@ class Database:
         except PermissionError:
             pass
 
-    def delete_image(self, group_id: int, file_name: str) -> None:
-        """ Delete the image data """
-        try:
-            os.remove(f"{self._path}/{group_id}/images/{file_name}.jpg")
-        except FileNotFoundError:
-            pass
-        except PermissionError:
-            pass
+    def delete_image(self, group_id: int, set_name: str, digest: str) -> None:
+        """ Remove the image from a set """
+        self.images.remove(group_id, set_name, digest)
+
+    def delete_image_set(self, group_id: int, set_name: str) -> None:
+        """ Remove every image of a set """
+        self.images.remove_set(group_id, set_name)
+
+    def list_images(self, group_id: int, set_name: str) -> dict[str, int]:
+        """ Get digests and sizes of the images in a set """
+        return self.images.list(group_id, set_name)
 
     def list_files(self, subdir: str) -> list[str]:
         """ List all files in a directory """
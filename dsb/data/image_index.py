@@ -0,0 +1,49 @@
+""" In-memory index of image sets """
+
+import threading
+from dsb.data.database import Database
+
+class ImageIndex:
+    """ Names and sizes of images of every chat set, each set is listed from disk once """
+    def __init__(self, database: Database) -> None:
+        self._database = database
+        self._sets: dict[tuple[int, str], dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def __get(self, chat_id: int, set_name: str) -> dict[str, int]:
+        """ Get the set, loading it on first use """
+        images = self._sets.get((chat_id, set_name), None)
+        if images is None:
+            images = self._database.list_images(chat_id, set_name)
+            with self._lock:
+                images = self._sets.setdefault((chat_id, set_name), images)
+        return images
+
+    def images(self, chat_id: int, set_name: str) -> list[str]:
+        """ Get image names of the set """
+        return list(self.__get(chat_id, set_name))
+
+    def add(self, chat_id: int, set_name: str, image_name: str, size: int) -> None:
+        """ Record a new or replaced image """
+        images = self.__get(chat_id, set_name)
+        with self._lock:
+            images[image_name] = size
+
+    def remove(self, chat_id: int, set_name: str, image_name: str) -> None:
+        """ Forget an image """
+        with self._lock:
+            self._sets.get((chat_id, set_name), {}).pop(image_name, None)
+
+    def drop_set(self, chat_id: int, set_name: str) -> None:
+        """ Forget the whole set """
+        with self._lock:
+            self._sets.pop((chat_id, set_name), None)
+
+    def stats(self, chat_id: int, set_names) -> dict[str, tuple[int, int]]:
+        """ Get image count and total bytes of the given sets """
+        stats = {}
+        for set_name in set_names:
+            images = self.__get(chat_id, set_name)
+            with self._lock:
+                stats[set_name] = (len(images), sum(images.values()))
+        return stats
@@ -0,0 +1,199 @@
+""" Content addressed image storage """
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+class ImageWriter:
+    """ Temporary file hashing everything written to it """
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile( # pylint: disable=R1732
+            dir=directory, suffix=".part", delete=False)
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    @property
+    def path(self) -> str:
+        """ Path of the temporary file """
+        return self._file.name
+
+    @property
+    def digest(self) -> str:
+        """ SHA-256 of the written data """
+        return self._hash.hexdigest()
+
+    def write(self, data: bytes) -> int:
+        """ Write and hash a chunk """
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def close(self) -> None:
+        """ Flush the data to disk """
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def discard(self) -> None:
+        """ Remove the temporary file """
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class ImageStore:
+    """ Images stored once under their SHA-256, sets only keep references
+
+    Objects live in images/objects/ab/cd/<digest>.jpg, every chat has an
+    images.json manifest of {set name: {digest: size}}. Reference counts are
+    rebuilt from the manifests on first use, an object is removed once no
+    set references it. Old per-set image folders are imported on first access.
+    """
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._objects = os.path.join(path, "images", "objects")
+        self._manifests: dict[int, dict[str, dict[str, int]]] = {}
+        self._refcounts: dict[str, int] | None = None
+        self._lock = threading.RLock()
+
+    def path(self, digest: str) -> str:
+        """ Get path of the stored object """
+        return os.path.join(self._objects, digest[:2], digest[2:4], f"{digest}.jpg")
+
+    def writer(self) -> ImageWriter:
+        """ Get temporary file to stream a new image into """
+        return ImageWriter(os.path.join(self._path, "images", "tmp"))
+
+    def __manifest_path(self, group_id: int) -> str:
+        return os.path.join(self._path, str(group_id), "images.json")
+
+    def __manifest(self, group_id: int) -> dict[str, dict[str, int]]:
+        """ Get the set references of the chat """
+        manifest = self._manifests.get(group_id, None)
+        if manifest is not None:
+            return manifest
+        try:
+            with open(self.__manifest_path(group_id), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            manifest = {}
+        self._manifests[group_id] = manifest
+        if self.__import_legacy(group_id, manifest):
+            self.__save_manifest(group_id)
+        return manifest
+
+    def __save_manifest(self, group_id: int) -> None:
+        """ Write the manifest atomically """
+        path = self.__manifest_path(group_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self._manifests[group_id], f)
+        os.replace(f"{path}.tmp", path)
+
+    def __counts(self) -> dict[str, int]:
+        """ Reference counts of every object, built from all manifests once """
+        if self._refcounts is None:
+            counts = {}
+            with os.scandir(self._path) as entries:
+                groups = [entry.name for entry in entries if entry.is_dir()
+                          and entry.name.lstrip("-").isdigit()]
+            for group in groups:
+                for images in self.__manifest(int(group)).values():
+                    for digest in images:
+                        counts[digest] = counts.get(digest, 0) + 1
+            self._refcounts = counts
+        return self._refcounts
+
+    def __store(self, path: str, digest: str) -> None:
+        """ Move the file into the object store, dropping it if already stored """
+        target = self.path(digest)
+        if os.path.exists(target):
+            os.remove(path)
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def __import_legacy(self, group_id: int, manifest: dict) -> bool:
+        """ Move images saved in {group}/images/{set}/ into the store """
+        legacy = os.path.join(self._path, str(group_id), "images")
+        if not os.path.isdir(legacy):
+            return False
+        for set_name in os.listdir(legacy):
+            set_path = os.path.join(legacy, set_name)
+            if not os.path.isdir(set_path):
+                continue
+            images = manifest.setdefault(set_name, {})
+            for file_name in os.listdir(set_path):
+                file_path = os.path.join(set_path, file_name)
+                with open(file_path, "rb") as f:
+                    digest = hashlib.file_digest(f, "sha256").hexdigest()
+                if digest not in images:
+                    images[digest] = os.path.getsize(file_path)
+                    if self._refcounts is not None:
+                        self._refcounts[digest] = self._refcounts.get(digest, 0) + 1
+                self.__store(file_path, digest)
+            os.rmdir(set_path)
+        try:
+            os.rmdir(legacy)
+        except OSError:
+            pass
+        return True
+
+    def add(self, group_id: int, set_name: str, writer: ImageWriter) -> str:
+        """ Store the written image and reference it from the set, returns its digest """
+        writer.close()
+        digest = writer.digest
+        with self._lock:
+            counts = self.__counts()
+            images = self.__manifest(group_id).setdefault(set_name, {})
+            if digest in images:
+                writer.discard()
+                return digest
+            self.__store(writer.path, digest)
+            images[digest] = writer.size
+            counts[digest] = counts.get(digest, 0) + 1
+            self.__save_manifest(group_id)
+        return digest
+
+    def remove(self, group_id: int, set_name: str, digest: str) -> None:
+        """ Drop reference from the set and the object once it is unused """
+        with self._lock:
+            self.__counts()
+            images = self.__manifest(group_id).get(set_name, {})
+            if images.pop(digest, None) is None:
+                return
+            self.__release(digest)
+            self.__save_manifest(group_id)
+
+    def remove_set(self, group_id: int, set_name: str) -> None:
+        """ Drop every reference of the set """
+        with self._lock:
+            self.__counts()
+            images = self.__manifest(group_id).pop(set_name, None)
+            if images is None:
+                return
+            for digest in images:
+                self.__release(digest)
+            self.__save_manifest(group_id)
+
+    def __release(self, digest: str) -> None:
+        """ Decrease the reference count, deleting the object when it drops to zero """
+        counts = self.__counts()
+        counts[digest] = counts.get(digest, 1) - 1
+        if counts[digest] > 0:
+            return
+        counts.pop(digest, None)
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+    def list(self, group_id: int, set_name: str) -> dict[str, int]:
+        """ Get digests and sizes of the images in a set """
+        with self._lock:
+            return dict(self.__manifest(group_id).get(set_name, {}))
@@ -1,15 +1,22 @@
 """ Custom persistence for DSB """
 
 import os
+import time
 from telegram.ext import BasePersistence
 import jsonpickle
+from dsb.utils.metrics import REGISTRY
 
-class CustomPersistance(BasePersistence):
+class CustomPersistance(BasePersistence): # pylint: disable=R0904
     """ Custom persistence for the bot """
     def __init__(self, store_data = None, update_interval = 60,
                  store_path = "dsb/database/"):
         super().__init__(store_data, update_interval)
         self._store_path = store_path
+        self._chat_listeners = []
+
+    def add_chat_listener(self, listener) -> None:
+        """ Call listener with chat id every time chat data is saved """
+        self._chat_listeners.append(listener)
 
     async def get_data(self, dir_name: str) -> dict:
         """ Get data from the directory """
@@ -21,23 +28,36 @@ class CustomPersistance(BasePersistence):
             data.update({int(file_name.replace('.json', '')): temp})
         return data
 
+    @staticmethod
+    def _observe(operation: str, file_name: str, start: float) -> None:
+        """ Record duration of a persistence call """
+        REGISTRY.histogram("dsb_persistence_seconds", "Duration of persistence calls",
+                           operation=operation, store=file_name.split("/")[0]) \
+            .observe(time.perf_counter() - start)
+
     async def get_file_data(self, file_name: str) -> dict:
         """ Helper function """
+        start = time.perf_counter()
         file_path = os.path.join(self._store_path, f"{file_name}.json")
         if not os.path.exists(file_path):
             return {}
-        with open(file_path, "r", encoding='utf-8') as f:
-            data = jsonpickle.decode(f.read(), keys=True)
-            if data is None:
-                return {}
-            return data
+        try:
+            with open(file_path, "r", encoding='utf-8') as f:
+                data = jsonpickle.decode(f.read(), keys=True)
+                if data is None:
+                    return {}
+                return data
+        finally:
+            self._observe("read", file_name, start)
 
     async def update_file_data(self, file_name: str, data) -> None:
         """ Helper function """
+        start = time.perf_counter()
         file_path = os.path.join(self._store_path, f"{file_name}.json")
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
         with open(file_path, "w", encoding='utf-8') as f:
             f.write(jsonpickle.encode(data, keys=True, indent=4))
+        self._observe("write", file_name, start)
 
     async def drop_data(self, file_name: str) -> None:
         """ Helper function """
@@ -70,7 +90,9 @@ class CustomPersistance(BasePersistence):
         return await self.update_file_data("callback_data", data)
 
     async def update_chat_data(self, chat_id: int, data):
-        return await self.update_file_data(f"chat_data/{chat_id}", data)
+        await self.update_file_data(f"chat_data/{chat_id}", data)
+        for listener in self._chat_listeners:
+            listener(chat_id)
 
     async def update_user_data(self, user_id: int, data):
         return await self.update_file_data(f"user_data/{user_id}", data)
@@ -1,46 +1,91 @@
 """ Main module of DSB """
 
 import os
+import sys
+import signal
+import secrets
 import time
 import logging
-import threading
 import importlib
-import dotenv
-import schedule
 import asyncio
+import platform
+from urllib.parse import urlparse
+import dotenv
 from telegram import Update
 from telegram.ext import Application, CallbackContext, ContextTypes
 from dsb.data.database import Database
-from dsb.types.module import BaseModule
+from dsb.utils.render_cache import RenderCache
+from dsb.utils.logs import (DATE_FORMAT, LOG_FORMAT, BatchedFileHandler, JsonFormatter, LogBuffer,
+                            LogListener, LogQueueHandler, parse_level, tail, update_fields)
+from dsb.utils.loop_monitor import LoopMonitor
+from dsb.utils.metrics import InstrumentedRequest
+from dsb.utils.scheduler import Scheduler
+from dsb.types.module import BaseModule, add_handler, remove_handler
+from dsb.utils.manifest import ModuleManifest, scan_modules
+from dsb.utils.metrics import REGISTRY
+from dsb.utils.startup import StartupProfile
+from dsb.utils.update_processor import ChatOrderedProcessor
+from dsb.utils.reloader import ModuleTracker, reloadable
 from dsb.api.dsbapi import DSBApiThread
+from dsb.api.webhook import WebhookReceiver
 from dsb.types.errors import DSBError
 from dsb.data.persistence import CustomPersistance
-from dsb.types.handlers import AdminCommandHandler
+from dsb.types.handlers import CallbackRouter, CommandRouter
 
-class DSB:
+class DSB: # pylint: disable=R0902
     """ DatSimonBot - telegram app """
-    def __init__(self):
+    def __init__(self, profile_startup: bool = False):
+        self.startup = StartupProfile()
+        self._profile_startup = profile_startup
         self._config = self.__get_env()
-        self.database = Database()
+        with self.startup.measure("database"):
+            self.database = Database()
+        self.render_cache = RenderCache()
+        self._warm_up_task: asyncio.Task | None = None
+        self._initialize_started = 0.0
 
-        self._modules: list[BaseModule] = []
+        self._tracker = ModuleTracker()
         self._active_modules: dict[str, BaseModule] = {}
-        self._api_task = DSBApiThread(self.database, self._config["api_port"])
+        self._manifests: dict[str, ModuleManifest] = {}
+        self._stubs: dict[str, list] = {}
+        self._module_locks: dict[str, asyncio.Lock] = {}
+        self._api_task = DSBApiThread(self.database, self._config["api_port"],
+                                      self._config.get("api_workers", 8), self.render_cache)
         
+        self.log_buffer = LogBuffer(int(self._config.get("log_buffer", 1000)))
+        self._log_listener: LogListener | None = None
         self._logger = self.__create_logger()
         
-        self._scheduler = schedule.Scheduler()
-        self._ticker_thread = threading.Thread(target=self.__ticker)
-        self._stop_event = threading.Event()
+        self._scheduler = Scheduler(self._logger)
+        self.loop_monitor = LoopMonitor(
+            int(self._config.get("loop_lag_threshold_ms", 250)) / 1000, logger=self._logger)
         
         builder = Application.builder().token(self._config["token"])
-        builder.persistence(CustomPersistance())
+        persistence = CustomPersistance()
+        persistence.add_chat_listener(self._api_task.notify_chat_changed)
+        builder.persistence(persistence)
         builder.arbitrary_callback_data(True)
+        if self._config.get("bot_api_url", None):
+            api_url = self._config["bot_api_url"].rstrip("/")
+            builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+        builder.request(InstrumentedRequest(connection_pool_size=256))
+        builder.get_updates_request(InstrumentedRequest())
+        builder.post_init(self.__post_init)
+        builder.post_shutdown(self.__post_shutdown)
+        concurrent_updates = int(self._config.get("concurrent_updates", 1))
+        if concurrent_updates > 1:
+            builder.concurrent_updates(ChatOrderedProcessor(concurrent_updates))
         
-        self._app = builder.build()
+        with self.startup.measure("application build"):
+            self._app = builder.build()
 
+        self.router = CommandRouter(self)
+        self.callback_router = CallbackRouter()
+        self._app.add_handler(self.router)
+        self._app.add_handler(self.callback_router)
         self._app.add_error_handler(self.__error_handler)
         self.__add_system_commands()
+        self._webhook = self.__create_webhook()
 
     @property
     def admins(self) -> list[int]:
@@ -48,27 +93,47 @@ class DSB:
         return self._config["admins"]
 
     @property
-    def scheduler(self) -> schedule.Scheduler:
+    def scheduler(self) -> Scheduler:
         """ DSB scheduler """
         return self._scheduler
 
-    @property
-    def logs(self) -> list[str]:
-        """ Get the logs """
-        with open("dsb.log", 'r', encoding="utf-8") as log_file:
-            return log_file.readlines()
+    async def logs(self, count: int = 1, level: str | None = None,
+                   module: str | None = None) -> list[str]:
+        """ Last log records, oldest first
+
+        Served from the in-memory buffer, the end of the log file is only read,
+        in a thread, when the buffer does not hold enough matching records.
+        """
+        lines = self.log_buffer.lines(count, level, module)
+        if len(lines) < count:
+            lines = await asyncio.to_thread(tail, "dsb.log", count, level, module,
+                                            int(self._config.get("log_backups", 3)))
+        return lines
 
     @property
-    def commands(self) -> list[str]:
+    def commands(self) -> dict[str, str]:
         """ Get commands list """
         commands = {}
+        for name in self._stubs:
+            commands.update(self._manifests[name].descriptions)
         for module in self._active_modules.values():
             commands.update(module.descriptions)
         return commands
 
+    def get_handler(self, command: str):
+        """ Get the function handling the command, stubs for modules not loaded yet """
+        for module in self._active_modules.values():
+            if command in module.handlers:
+                return module.handlers[command][0]
+        for stubs in self._stubs.values():
+            for handler in stubs:
+                if getattr(handler.callback, "_command_name", None) == command:
+                    return handler.callback
+        return None
+
     async def __error_handler(self, update: Update, context: CallbackContext) -> None:
         """Log the error and send a message to the user."""
-        self._logger.error("An error occurred: %s", context.error)
+        self._logger.error("An error occurred: %s", context.error, extra=update_fields(update))
         if update.message is None:
             return
         if isinstance(context.error, DSBError):
@@ -77,25 +142,144 @@ class DSB:
             await update.message.reply_text('Unexpected error occured. Dev skill issue.')
 
     def __add_system_commands(self) -> None:
-        self._app.add_handler(AdminCommandHandler(self, "reload", self.__reload_modules))
-        self._app.add_handler(AdminCommandHandler(self, "quit", self.__quit_handler))
+        self.router.add("reload", self.__reload_modules, admin=True)
+        self.router.add("quit", self.__quit_handler, admin=True)
+
+    async def __post_init(self, _: Application) -> None:
+        """ Start services living in the bot event loop """
+        self._scheduler.start()
+        self.loop_monitor.start()
+        if self._initialize_started:
+            self.startup.record("application initialize",
+                                time.perf_counter() - self._initialize_started)
+        self.startup.record("persistence load", sum(
+            histogram.sum for _, histogram in REGISTRY.histograms("dsb_persistence_seconds")))
+        self.startup.mark_ready()
+        if self._profile_startup:
+            print(self.startup.report())
+        self._warm_up_task = asyncio.get_running_loop().create_task(self.__warm_up())
+
+    async def __warm_up(self) -> None:
+        """ Load expensive resources in the background once the bot answers updates """
+        with self.startup.measure("warm-up total"):
+            with self.startup.measure("warm-up matplotlib"):
+                await asyncio.to_thread(self.render_cache.warm_up)
+            for manifest in list(self._manifests.values()):
+                if manifest.static and manifest.name not in self._active_modules:
+                    await self.__activate(manifest)
+            for name, module in list(self._active_modules.items()):
+                with self.startup.measure(f"warm-up {name}"):
+                    try:
+                        await asyncio.to_thread(module.warm_up)
+                    except Exception as e: # pylint: disable=W0718
+                        self._logger.error("Failed to warm up module %s: %s", name, e)
+        if self._profile_startup:
+            print(self.startup.report())
+
+    async def __post_shutdown(self, _: Application) -> None:
+        """ Stop services living in the bot event loop """
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
+        await self._scheduler.shutdown()
+        await self.loop_monitor.shutdown()
+
+    def __create_webhook(self) -> WebhookReceiver | None:
+        """ Webhook receiver if webhook_url is configured
+
+        It is served on the api port unless webhook_port differs, the secret is
+        random on every start if webhook_secret is not configured.
+        """
+        url = self._config.get("webhook_url", None)
+        if not url:
+            return None
+        secret = self._config.get("webhook_secret", None) or secrets.token_urlsafe(32)
+        path = self._config.get("webhook_path", None) or urlparse(url).path or "/telegram"
+        receiver = WebhookReceiver(secret, path)
+        if self.__webhook_port() == int(self._config["api_port"]):
+            self._api_task.add_webhook(receiver)
+        return receiver
+
+    def __webhook_port(self) -> int:
+        return int(self._config.get("webhook_port", None) or self._config["api_port"])
+
+    def __enqueue_update(self, data: dict) -> None:
+        """ Queue update received by the webhook, runs in the bot event loop """
+        try:
+            update = Update.de_json(data, self._app.bot)
+        except Exception as exc: # pylint: disable=broad-except
+            self._logger.warning("Invalid webhook update: %s", exc)
+            return
+        if update is None:
+            return
+        self._app.bot.insert_callback_data(update)
+        self._app.update_queue.put_nowait(update)
+
+    async def __start_webhook(self) -> None:
+        """ Initialize the application and point Telegram at the webhook """
+        await self._app.initialize()
+        await self._app.post_init(self._app)
+        loop = asyncio.get_running_loop()
+        self._webhook.attach(lambda data: loop.call_soon_threadsafe(self.__enqueue_update, data))
+        if self.__webhook_port() != int(self._config["api_port"]):
+            await self._webhook.start(self._config.get("webhook_listen", None) or "127.0.0.1",
+                                      self.__webhook_port())
+        await self._app.start()
+        await self._app.bot.set_webhook(
+            self._config["webhook_url"], secret_token=self._webhook.secret,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=int(self._config.get("webhook_max_connections", None) or 40))
+        self._logger.info("Receiving updates on %s", self._config["webhook_url"])
+
+    async def __stop_webhook(self) -> None:
+        """ Stop receiving updates and shut the application down """
+        self._webhook.attach(None)
+        await self._webhook.stop()
+        if self._app.running:
+            await self._app.stop()
+        await self._app.shutdown()
+        await self._app.post_shutdown(self._app)
+
+    def __run_webhook(self) -> None:
+        """ Run the application until stop_running or a stop signal, like run_polling """
+        loop = asyncio.get_event_loop()
+        if platform.system() != "Windows":
+            for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+                loop.add_signal_handler(sig, self.__raise_system_exit)
+        try:
+            loop.run_until_complete(self.__start_webhook())
+            loop.run_forever()
+        except SystemExit:
+            self._logger.info("Received stop signal, shutting down")
+        finally:
+            loop.run_until_complete(self.__stop_webhook())
+            loop.close()
 
-    def __ticker(self, tick_length: int = 1) -> None:
-        """ Schedule timer """
-        while not self._stop_event.is_set():
-            self._scheduler.run_pending()
-            time.sleep(tick_length)
+    @staticmethod
+    def __raise_system_exit() -> None:
+        """ Signal handler leaving run_forever, the shutdown runs in its finally """
+        raise SystemExit
 
     def __create_logger(self) -> logging.Logger:
-        """ Create and set up logger """
+        """ Create and set up logger
+
+        Records are put on a queue and written to dsb.log by a listener thread,
+        so logging from handlers never waits for the disk. log_format=json
+        writes one JSON object per line with the update fields.
+        """
         logger = logging.getLogger("DSB")
-        logger.setLevel(logging.INFO)
+        logger.setLevel(parse_level(self._config.get("log_level", None) or "INFO"))
         logger.propagate = False
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s',
-                                        datefmt='%Y-%m-%d %H:%M:%S')
-        handler = logging.FileHandler("dsb.log")
+        if self._config.get("log_format", None) == "json":
+            formatter = JsonFormatter(datefmt=DATE_FORMAT)
+        else:
+            formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+        handler = BatchedFileHandler("dsb.log", int(self._config.get("log_max_bytes", 5_000_000)),
+                                     int(self._config.get("log_backups", 3)))
         handler.setFormatter(formatter)
-        logger.addHandler(handler)
+        self._log_listener = LogListener(handler)
+        self._log_listener.start()
+        logger.addHandler(LogQueueHandler(self._log_listener.queue))
+        logger.addHandler(self.log_buffer)
         return logger
 
     def __get_env(self) -> dict:
@@ -119,64 +303,175 @@ class DSB:
         return values
 
     def __load_modules(self) -> None:
-        """ Load avaible modules """
-        for module in os.listdir("dsb/modules"):
-            if module.startswith("__"):
-                continue
-            module_name = module.replace(".py", "").title().replace("_", "")
-            module_path = f"dsb.modules.{module.replace('.py', '')}"
-            if module_name in self._active_modules:
+        """ Load eager modules, lazy ones are only scanned for their commands """
+        with self.startup.measure("scan modules"):
+            self._manifests = scan_modules()
+        for module_name, manifest in self._manifests.items():
+            module_path = manifest.import_path
+            if module_name in self._active_modules or manifest.static:
                 continue
             try:
-                module = importlib.import_module(module_path)
-                self._modules.append((module_name, module))
+                with self.startup.measure(f"import {module_name}"):
+                    module = importlib.import_module(module_path)
                 module_class = getattr(module, module_name, None)
                 if module_class is None or not issubclass(module_class, BaseModule):
                     continue
-                module_instance = module_class(self._app, self)
-            except Exception as e:
+                with self.startup.measure(f"init {module_name}"):
+                    module_instance = module_class(self._app, self)
+            except Exception as e: # pylint: disable=W0718
                 print(f"Failed to load module {module_name}")
                 self._logger.error("Failed to load module %s: %s", module_name, e)
                 continue
             self._active_modules[module_name] = module_instance
+        self._tracker.track()
 
     async def __reload_modules(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
-        """ Reload modules during runtime """
+        """ Reload changed modules and the modules depending on them
+
+        Modules are only marked as loaded once their reload and swap succeeded,
+        failed ones are tried again by the next /reload.
+        """
         importlib.invalidate_caches()
-        self.__disable_modules()
-        self.__load_modules()
+        changed = self._tracker.changed()
+        affected = self._tracker.dependents(changed)
         message = ""
-        for name, mod in self._modules:
+        failed = set()
+        reloaded = []
+        for name in self._tracker.order({name for name in affected if reloadable(name)}):
+            start = time.perf_counter()
             try:
-                importlib.reload(mod)
-                module_class = getattr(mod, name, None)
-                module_instance = module_class(self._app, self)
-            except Exception as e:
-                message = f"{message}{name} failed to reload\n"
+                importlib.reload(sys.modules[name])
+            except Exception as e: # pylint: disable=W0718
+                failed.add(name)
+                message += f"{name} failed to reload\n"
                 self._logger.error("Failed to reload module %s: %s", name, e)
                 continue
-            self._active_modules[name] = module_instance
-        self.__start_modules()
-        await update.message.reply_text(f"Reloaded.\n{message}")
+            reloaded.append(name)
+            message += f"{name}: {(time.perf_counter() - start) * 1000:.0f} ms\n"
+        restart = sorted(name for name in changed if not reloadable(name))
+        if restart:
+            message += "Restart required for: " + ", ".join(restart) + "\n"
+        manifests = scan_modules()
+        for name, manifest in manifests.items():
+            if manifest.import_path in failed:
+                continue
+            if name in self._manifests and manifest.import_path not in affected:
+                continue
+            start = time.perf_counter()
+            if self.__swap_module(manifest):
+                message += f"{name} swapped in {(time.perf_counter() - start) * 1000:.0f} ms\n"
+            else:
+                failed.add(manifest.import_path)
+                message += f"{name} failed to start, kept the old version\n"
+        for name in reloaded:
+            if name not in failed:
+                self._tracker.mark_loaded(name)
+        self._manifests.update(manifests)
+        await update.message.reply_text(f"Reloaded.\n{message}" if message
+                                        else "Nothing changed.")
+
+    def __swap_module(self, manifest: ModuleManifest) -> bool:
+        """ Replace handlers of the module with the reloaded version in one step
+
+        Runs without awaiting, so no update is dispatched between removing the old
+        handlers and adding the new ones.
+        """
+        name = manifest.name
+        old_instance = self._active_modules.get(name, None)
+        if old_instance is None and manifest.static:
+            self.__remove_stubs(name)
+            self._manifests[name] = manifest
+            self.__register_stubs(manifest)
+            return True
+        try:
+            module = sys.modules.get(manifest.import_path, None)
+            if module is None:
+                module = importlib.import_module(manifest.import_path)
+            module_instance = getattr(module, name)(self._app, self)
+            if not module_instance.prepare():
+                raise DSBError(f"Failed to prepare module {name}")
+        except Exception as e: # pylint: disable=W0718
+            self._logger.error("Failed to swap module %s: %s", name, e)
+            return False
+        if old_instance is not None:
+            old_instance.remove_handlers()
+        self.__remove_stubs(name)
+        module_instance.add_handlers()
+        self._active_modules[name] = module_instance
+        self._tracker.track()
+        return True
 
     def __start_modules(self) -> None:
-        """ Start all modules """
+        """ Start loaded modules and register stubs of the lazy ones """
         for module in self._active_modules.values():
             if module.prepare():
                 module.add_handlers()
                 continue
             self._logger.error("Failed to prepare module %s", module.__class__.__name__)
+        for name, manifest in self._manifests.items():
+            if name in self._active_modules or name in self._stubs or not manifest.static:
+                continue
+            self.__register_stubs(manifest)
 
-    def __disable_modules(self) -> None:
-        """ Disable every module """
-        for module in self._active_modules.values():
-            module.remove_handlers()
+    def __register_stubs(self, manifest: ModuleManifest) -> None:
+        """ Add stub handlers for every command of a lazy module """
+        self._stubs[manifest.name] = [
+            add_handler(self, self._app, command, handler_type,
+                        self.__create_stub(manifest, command))
+            for command, handler_type in manifest.handlers.items()]
+
+    def __remove_stubs(self, name: str) -> None:
+        """ Remove stub handlers of the module """
+        for handler in self._stubs.pop(name, []):
+            remove_handler(self, self._app, handler)
+
+    def __create_stub(self, manifest: ModuleManifest, command: str):
+        """ Handler importing the module on first use and passing the update to it """
+        async def stub(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+            module = await self.__activate(manifest)
+            if module is None:
+                raise DSBError("This command is unavailable right now")
+            await module.handlers[command][0](update, context)
+        stub.__doc__ = manifest.docs.get(command, None)
+        stub._command_name = command # pylint: disable=W0212
+        return stub
+
+    def __instantiate(self, manifest: ModuleManifest) -> BaseModule:
+        """ Import the module and create its instance, runs in a worker thread
+
+        Constructors may do blocking I/O, like the planner creating its Koleo
+        client, so both run off the event loop.
+        """
+        module = importlib.import_module(manifest.import_path)
+        return getattr(module, manifest.name)(self._app, self)
+
+    async def __activate(self, manifest: ModuleManifest) -> BaseModule | None:
+        """ Import, instantiate and start a lazy module """
+        name = manifest.name
+        async with self._module_locks.setdefault(name, asyncio.Lock()):
+            if name in self._active_modules:
+                return self._active_modules[name]
+            start = time.perf_counter()
+            try:
+                module_instance = await asyncio.to_thread(self.__instantiate, manifest)
+            except Exception as e: # pylint: disable=W0718
+                self._logger.error("Failed to load module %s: %s", name, e)
+                return None
+            if not module_instance.prepare():
+                self._logger.error("Failed to prepare module %s", name)
+                return None
+            self.__remove_stubs(name)
+            module_instance.add_handlers()
+            self._active_modules[name] = module_instance
+            self._tracker.track()
+            self.startup.record(f"lazy load {name}", time.perf_counter() - start)
+            self._logger.info("Loaded module %s on first use", name)
+            return module_instance
 
     def __quit(self) -> None:
-        self._stop_event.set()
         self._api_task.shutdown()
         self._api_task.join()
-        self._ticker_thread.join()
+        self.render_cache.shutdown()
         self._logger.info("DSB stopped")
 
     async def __quit_handler(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
@@ -198,18 +493,26 @@ class DSB:
 
     def start(self) -> None:
         """ Start the app """
-        self._ticker_thread.start()
         self._logger.info("DSB started")
 
         try:
             print("Starting...")
+            api_started = time.perf_counter()
             self._api_task.start()
             print(f"Api running on port {self._config["api_port"]}")
             self.__load_modules()
-            self.__start_modules()
+            with self.startup.measure("start modules"):
+                self.__start_modules()
+            if self._api_task.ready.wait(5):
+                self.startup.record("api thread start", time.perf_counter() - api_started)
             print("Finished loading.")
-            self._app.run_polling()
+            self._initialize_started = time.perf_counter()
+            if self._webhook is not None:
+                self.__run_webhook()
+            else:
+                self._app.run_polling()
         except KeyboardInterrupt:
             pass
         finally:
             self.__quit()
+            self._log_listener.stop()
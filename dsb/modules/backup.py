@@ -2,19 +2,22 @@
 
 import os
 import shutil
+from typing import TYPE_CHECKING
 from telegram import Update
 from telegram.ext import Application, ContextTypes
-from dsb.old_dsb import DSB
 from dsb.types.module import BaseModule, HandlerType
+if TYPE_CHECKING:
+    from dsb.dsb import DSB
 
 class Backup(BaseModule):
     """ Backup module """
-    def __init__(self, bot: Application, telebot_module: DSB) -> None:
+    _handler_names = {
+        "backup": ("_backup", HandlerType.BOT_ADMIN),
+        "restore": ("_restore", HandlerType.BOT_ADMIN)
+    }
+
+    def __init__(self, bot: Application, telebot_module: 'DSB') -> None:
         super().__init__(bot, telebot_module)
-        self._handlers = {
-            "backup": (self._backup, HandlerType.BOT_ADMIN),
-            "restore": (self._restore, HandlerType.BOT_ADMIN)
-        }
         self._descriptions = {
             "backup": "Send a backup of the database",
             "restore": "Restore the database from a backup"
@@ -1,24 +1,37 @@
 """ Fun stuff to play with """
 
-import random
 import asyncio
+import functools
 from telegram import Update
 from telegram.ext import ContextTypes
 from dsb.types.module import BaseModule, HandlerType
+from dsb.data.image_index import ImageIndex
+from dsb.utils.delivery import Delivery
+from dsb.utils.image_deck import ImageDeck
 
 class DailyImages(BaseModule):
     """ Daily images module for DSB. """
+    lazy = False
+    _handler_names = {
+        "create_set": ("_create_set", HandlerType.DEFAULT),
+        "delete_set": ("_delete_set", HandlerType.DEFAULT),
+        "daily_image": ("_daily_image", HandlerType.DEFAULT),
+        "cancel_daily_image": ("_cancel_daily_image", HandlerType.DEFAULT),
+        "submit_image": ("_submit_image", HandlerType.DEFAULT),
+        "random_image": ("_random_image", HandlerType.DEFAULT),
+        "daily_report": ("_daily_report", HandlerType.BOT_ADMIN),
+        "set_stats": ("_set_stats", HandlerType.DEFAULT),
+    }
+
     def __init__(self, bot, dsb):
         super().__init__(bot, dsb)
         self._daily_job = None
-        self._handlers = {
-            "create_set": (self._create_set, HandlerType.DEFAULT),
-            "delete_set": (self._delete_set, HandlerType.DEFAULT),
-            "daily_image": (self._daily_image, HandlerType.DEFAULT),
-            "cancel_daily_image": (self._cancel_daily_image, HandlerType.DEFAULT),
-            "submit_image": (self._submit_image, HandlerType.DEFAULT),
-            "random_image": (self._random_image, HandlerType.DEFAULT),
-        }
+        self._prepare_job = None
+        self._delivery = Delivery()
+        self._index = ImageIndex(dsb.database)
+        self._decks: dict[tuple[int, str], ImageDeck] = {}
+        self._file_ids: dict[str, str] = {}
+        self._staged: dict[int, str] = {}
         self._descriptions = {
             "create_set": "Create a new set for daily images",
             "delete_set": "Delete a set for daily images",
@@ -26,6 +39,8 @@ class DailyImages(BaseModule):
             "cancel_daily_image": "Cancel daily image",
             "submit_image": "Submit an image to a set",
             "random_image": "Send a random image from a set",
+            "daily_report": "Get the report of the last daily image run",
+            "set_stats": "Show number of images and size of every set",
         }
 
     async def _create_set(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -76,7 +91,12 @@ class DailyImages(BaseModule):
         if not args:
             await update.message.reply_text("Please provide a set name")
             return
-        sets.remove(" ".join(args))
+        set_name = " ".join(args)
+        sets.remove(set_name)
+        await asyncio.to_thread(self._dsb.database.delete_image_set,
+                                update.effective_chat.id, set_name)
+        self._index.drop_set(update.effective_chat.id, set_name)
+        self._decks.pop((update.effective_chat.id, set_name), None)
         await update.message.reply_text("Set deleted")
 
     async def _daily_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -138,34 +158,87 @@ class DailyImages(BaseModule):
             msg = update.message.reply_to_message
         else:
             msg = update.message
+        if image_set not in sets:
+            await update.message.reply_text("Set not found")
+            return
         file = await msg.photo[-1].get_file()
         if not file:
             await update.message.reply_text("No file found")
             return
-        image_bytes = await file.download_as_bytearray()
-        if image_set not in sets:
-            await update.message.reply_text("Set not found")
-            return
-        self._dsb.database.save_image(update.effective_chat.id,
-                                      f"{image_set}/file.file_id", image_bytes)
+        chat_id = update.effective_chat.id
+        writer = self._dsb.database.image_writer()
+        try:
+            await file.download_to_memory(writer)
+        except Exception:
+            writer.discard()
+            raise
+        size = writer.size
+        image_name = await asyncio.to_thread(self._dsb.database.save_image,
+                                             chat_id, image_set, writer)
+        self._file_ids[self._dsb.database.image_path(image_name)] = msg.photo[-1].file_id
+        self._index.add(chat_id, image_set, image_name, size)
+        deck = self._decks.get((chat_id, image_set), None)
+        if deck is not None:
+            deck.add(image_name)
         await update.message.reply_text("Image submitted to set")
 
-    def _get_image(self, chat_id: int, set_name: str) -> bytes:
-        """ Get a single image """
-        images = self._dsb.database.list_files(f"{chat_id}/{set_name}")
-        if not images:
-            return None
-        image_name = random.choice(images)
-        image = self._dsb.database.get_image(chat_id, image_name)
-        return image
+    def _draw_image(self, chat_id: int, set_name: str) -> str | None:
+        """ Pick image name from the set without repeats """
+        deck = self._decks.get((chat_id, set_name), None)
+        if deck is None:
+            deck = ImageDeck(self._index.images(chat_id, set_name))
+            self._decks[(chat_id, set_name)] = deck
+        return deck.draw()
+
+    async def _send_image(self, chat_id: int, image_name: str, send=None) -> None:
+        """ Send image by its cached file id, streaming it from disk the first time """
+        send = send or functools.partial(self._bot.bot.send_photo, chat_id)
+        path = self._dsb.database.image_path(image_name)
+        file_id = self._file_ids.get(path, None)
+        if file_id is not None:
+            await send(file_id)
+            return
+        with open(path, "rb") as image:
+            message = await send(image)
+        self._file_ids[path] = message.photo[-1].file_id
+
+    async def _prepare_daily_image(self) -> None:
+        """ Pick images for the next daily run so the run only calls the api
+
+        Sets without a deck are listed from disk in a thread, the decks are
+        only drawn from on the event loop like in the other handlers.
+        """
+        subscribed = list(self._bot.bot_data["daily_images"].items())
+        unlisted = [key for key in subscribed
+                    if key[0] not in self._staged and key not in self._decks]
+        await asyncio.to_thread(lambda: [self._index.images(*key) for key in unlisted])
+        for chat_id, set_name in subscribed:
+            if chat_id in self._staged:
+                continue
+            image_name = self._draw_image(chat_id, set_name)
+            if image_name is not None:
+                self._staged[chat_id] = image_name
 
     async def _send_daily_image(self) -> None:
         """ Send daily images """
-        for chat_id, set_name in self._bot.bot_data["daily_images"].items():
-            image = self._get_image(chat_id, set_name)
-            if not image:
-                continue
-            await self._bot.bot.send_photo(chat_id, image)
+        await self._prepare_daily_image()
+        staged, self._staged = self._staged, {}
+        subscribed = self._bot.bot_data["daily_images"]
+        jobs = [(chat_id, lambda chat_id=chat_id, image_name=image_name:
+                 self._send_image(chat_id, image_name))
+                for chat_id, image_name in staged.items() if chat_id in subscribed]
+        await self._delivery.run("daily_images", jobs)
+
+    async def _daily_report(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Get delivery time and failures of the last daily image run. (Admin only)
+
+        Usage: /daily_report
+        """
+        if self._delivery.last_report is None:
+            await update.message.reply_text("Daily images were not sent yet")
+            return
+        await update.message.reply_text(str(self._delivery.last_report))
 
     async def _random_image(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """ Send a random image from a set """
@@ -179,25 +252,43 @@ class DailyImages(BaseModule):
             sets = list(sets.keys())
             await update.message.reply_text("Avaible sets:\n" + "\n".join(sets))
             return
-        image = self._get_image(update.effective_chat.id, image_set)
-        if not image:
+        image_name = self._draw_image(update.effective_chat.id, image_set)
+        if image_name is None:
             await update.message.reply_text("No images found / no set with this name")
             return
-        await update.message.reply_photo(image)
+        await self._send_image(update.effective_chat.id, image_name, update.message.reply_photo)
+
+    async def _set_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Show the number of images and their size for every set of the chat.
+
+        Usage: /set_stats
+        """
+        sets = context.chat_data.get("sets", None)
+        if not sets:
+            await update.message.reply_text("No sets in this chat")
+            return
+        stats = await asyncio.to_thread(self._index.stats, update.effective_chat.id, sets)
+        message = "\n".join(f"{set_name}: {count} images, {size / 1024 / 1024:.1f} MB"
+                            for set_name, (count, size) in sorted(stats.items()))
+        await update.message.reply_text(message)
 
     def add_handlers(self):
         """ Add handlers """
-        loop = asyncio.get_event_loop()
-        self._daily_job = self._dsb.scheduler.every().\
-            day.at("06:00").do(lambda: loop.create_task(self._send_daily_image()))
+        self._prepare_job = self._dsb.scheduler.daily("05:55", self._prepare_daily_image,
+                                                      name="prepare_daily_images")
+        self._daily_job = self._dsb.scheduler.daily("06:00", self._send_daily_image,
+                                                    name="daily_images")
         return super().add_handlers()
 
     def remove_handlers(self):
         """ Remove handlers """
-        self._dsb.scheduler.cancel_job(self._daily_job)
+        self._dsb.scheduler.cancel(self._prepare_job)
+        self._dsb.scheduler.cancel(self._daily_job)
         return super().remove_handlers()
 
     def prepare(self):
         """ Prepare the module """
-        self._dsb.set_value("daily_images", {})
+        if "daily_images" not in self._bot.bot_data:
+            self._dsb.set_value("daily_images", {})
         return super().prepare()
@@ -0,0 +1,107 @@
+""" Module with runtime statistics of the bot """
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes
+from dsb.types.module import BaseModule, bot_admin_handler
+from dsb.utils.metrics import REGISTRY
+
+class Diagnostics(BaseModule):
+    """ Diagnostics module """
+    def __init__(self, ptb: Application, dsb) -> None:
+        super().__init__(ptb, dsb)
+        self._descriptions = {
+            "stats": "Get handler latency statistics",
+            "jobs": "List scheduled jobs",
+            "startup_stats": "Get startup timings",
+            "loop_lag": "Get event loop lag and what blocked the loop"
+        }
+
+    @staticmethod
+    def _summary(name: str, label: str, limit: int = 10) -> list[str]:
+        """ Lines with count, average and p99 of the slowest histograms """
+        histograms = [(labels, histogram) for labels, histogram
+                      in REGISTRY.histograms(name) if histogram.count]
+        histograms.sort(key=lambda item: item[1].sum, reverse=True)
+        errors = {tuple(sorted(labels.items())): counter.value for labels, counter
+                  in REGISTRY.counters(name.replace("_seconds", "_errors_total"))}
+        lines = []
+        for labels, histogram in histograms[:limit]:
+            avg = histogram.sum / histogram.count * 1000
+            p99 = histogram.quantile(0.99) * 1000
+            failed = int(errors.get(tuple(sorted(labels.items())), 0))
+            line = f"{labels.get(label, '?')}: {histogram.count}x avg {avg:.1f}ms p99<={p99:g}ms"
+            if failed:
+                line += f" errors {failed}"
+            lines.append(line)
+        return lines
+
+    @bot_admin_handler("stats")
+    async def _stats(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Get latency statistics of handlers, persistence, rendering and Bot API calls. (Admin only)
+
+        Usage: /stats
+        """
+        sections = {
+            "Handlers": ("dsb_handler_seconds", "handler"),
+            "Persistence": ("dsb_persistence_seconds", "store"),
+            "Rendering": ("dsb_render_seconds", "profile"),
+            "Bot API": ("dsb_telegram_request_seconds", "method"),
+        }
+        message = ""
+        for title, (name, label) in sections.items():
+            lines = self._summary(name, label)
+            if lines:
+                message += f"{title}:\n" + "\n".join(lines) + "\n\n"
+        cache = {labels["result"]: int(counter.value) for labels, counter
+                 in REGISTRY.counters("dsb_render_cache_total")}
+        if cache:
+            message += "Render cache: " + ", ".join(f"{result} {count}" for result, count
+                                                    in sorted(cache.items()))
+        await update.message.reply_text(message.strip() or "No statistics yet")
+
+    @bot_admin_handler("jobs")
+    async def _jobs(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        List jobs waiting in the scheduler. (Admin only)
+
+        Usage: /jobs
+        """
+        jobs = self._dsb.scheduler.jobs()
+        if not jobs:
+            await update.message.reply_text("No scheduled jobs")
+            return
+        await update.message.reply_text("\n".join(str(job) for job in jobs))
+
+    @bot_admin_handler("startup_stats")
+    async def _startup_stats(self, update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Get import, initialization and warm-up timings of the last start. (Admin only)
+
+        Usage: /startup_stats
+        """
+        await update.message.reply_text(f"```\n{self._dsb.startup.report()}\n```",
+                                        parse_mode="Markdown")
+
+    @bot_admin_handler("loop_lag")
+    async def _loop_lag(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Get event loop lag and the handlers that blocked the loop. (Admin only)
+
+        Usage: /loop_lag [--stack]
+        """
+        _, kwargs = self._get_args(context)
+        monitor = self._dsb.loop_monitor
+        lag = REGISTRY.histogram("dsb_loop_lag_seconds")
+        message = (f"Threshold {monitor.threshold * 1000:.0f} ms, "
+                   f"max lag {monitor.max_lag * 1000:.0f} ms")
+        if lag.count:
+            message += f", p99<={lag.quantile(0.99) * 1000:g} ms over {lag.count} wakeups"
+        reports = monitor.reports
+        if not reports:
+            await update.message.reply_text(f"{message}\nThe loop was not blocked")
+            return
+        message += "\n\n" + "\n".join(str(report) for report in reports[:10])
+        if "stack" in kwargs:
+            message += f"\n\nLast stack:\n{reports[0].stack[-(3900 - len(message)):]}"
+        await update.message.reply_text(message)
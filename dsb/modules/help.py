@@ -1,13 +1,15 @@
 """ Telebot help module """
 
+from typing import TYPE_CHECKING
 from telegram import Update
 from telegram.ext import ContextTypes, Application
 from dsb.types.module import BaseModule, command_handler
-from dsb.old_dsb import DSB
+if TYPE_CHECKING:
+    from dsb.dsb import DSB
 
 class Help(BaseModule):
     """ Help module """
-    def __init__(self, ptb: Application, dsb: DSB) -> None:
+    def __init__(self, ptb: Application, dsb: 'DSB') -> None:
         super().__init__(ptb, dsb)
         self._descriptions = {
             "help": "Display help message"
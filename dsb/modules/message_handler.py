@@ -7,32 +7,35 @@ from telegram import Update, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import filters, ContextTypes
 import telegram.ext
 import pronouncing
-from pydub import AudioSegment
-import speech_recognition as sr
 from dsb.types.module import BaseModule, HandlerType
+from dsb.types.errors import DSBError
 
 class MessageHandler(BaseModule):
     """ Module for handling text messages """
+    lazy = False
+    _handler_names = {
+        "who_am_i": ("_user_info", HandlerType.DEFAULT),
+        "who_are_you": ("_sender_info", HandlerType.DEFAULT),
+        "whoami": ("_user_info", HandlerType.DEFAULT),
+        "what_broke": ("_what_broke", HandlerType.BOT_ADMIN),
+        "logs": ("_logs", HandlerType.BOT_ADMIN),
+        "stt": ("_stt", HandlerType.DEFAULT),
+        "silly_cipher": ("_silly_cipher", HandlerType.DEFAULT),
+        "random_haiku": ("_get_random_haiku", HandlerType.DEFAULT),
+        "silly": ("_make_silly", HandlerType.INLINE),
+        "cls": ("_clear_chat", HandlerType.INLINE),
+        "clear": ("_clear_chat", HandlerType.INLINE),
+        "f": ("_format_text", HandlerType.INLINE),
+        "format": ("_format_text", HandlerType.INLINE)
+    }
+
     def __init__(self, ptb, telebot) -> None:
         super().__init__(ptb, telebot)
-        self._handlers = {
-            "who_am_i": (self._user_info, HandlerType.DEFAULT),
-            "who_are_you": (self._sender_info, HandlerType.DEFAULT),
-            "whoami": (self._user_info, HandlerType.DEFAULT),
-            "what_broke": (self._what_broke, HandlerType.BOT_ADMIN),
-            "stt": (self._stt, HandlerType.DEFAULT),
-            "silly_cipher": (self._silly_cipher, HandlerType.DEFAULT),
-            "random_haiku": (self._get_random_haiku, HandlerType.DEFAULT),
-            "silly": (self._make_silly, HandlerType.INLINE),
-            "cls": (self._clear_chat, HandlerType.INLINE),
-            "clear": (self._clear_chat, HandlerType.INLINE),
-            "f": (self._format_text, HandlerType.INLINE),
-            "format": (self._format_text, HandlerType.INLINE)
-        }
         self._descriptions = {
             "who_am_i": "Get user id",
             "whoami": "Get user id (alias)",
             "what_broke": "Get last log message",
+            "logs": "Get recent log messages",
             "silly_cipher": "Decode or encode from silly language",
             "stt": "Transcribe voice message",
             "random_haiku": "Get a random haiku from the chat"
@@ -44,7 +47,11 @@ class MessageHandler(BaseModule):
         }
         self._messages = {}
         self._message_handler = telegram.ext.MessageHandler(filters.ALL & ~filters.COMMAND,
-                              self._handle_text)
+                              self._timed("handle_text", "message", self._handle_text))
+
+    def warm_up(self) -> None:
+        """ Load the pronouncing dictionary used for haiku detection """
+        pronouncing.init_cmu()
 
     def add_handlers(self) -> None:
         """ Add handlers """
@@ -62,11 +69,50 @@ class MessageHandler(BaseModule):
         
         Usage: /what_broke
         """
-        if not self._dsb.logs:
+        logs = await self._dsb.logs(1)
+        if not logs:
+            await update.message.reply_text("No logs available")
+            return
+        await update.message.reply_text(self.__code_block(logs), parse_mode="Markdownv2")
+
+    async def _logs(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Get recent log messages. (Admin only)
+
+        Usage: /logs [count] [--level <level>] [--module <module>]
+        """
+        args, kwargs = self._get_args(context)
+        try:
+            count = int(args[0]) if args else 10
+        except ValueError as exc:
+            raise DSBError("Count has to be a number") from exc
+        level = kwargs.get("level", None)
+        module = kwargs.get("module", None)
+        if level is not None and not isinstance(level, str):
+            raise DSBError("Give a level name after --level, like --level warning")
+        if module is not None and not isinstance(module, str):
+            raise DSBError("Give a module name after --module")
+        try:
+            logs = await self._dsb.logs(max(1, min(count, 100)), level, module)
+        except ValueError as exc:
+            raise DSBError(str(exc)) from exc
+        if not logs:
             await update.message.reply_text("No logs available")
             return
-        message = self._dsb.logs[-1]
-        await update.message.reply_text(f"```{message}```", parse_mode="Markdownv2")
+        await update.message.reply_text(self.__code_block(logs), parse_mode="Markdownv2")
+
+    @staticmethod
+    def __code_block(lines: list[str], limit: int = 4000) -> str:
+        """ Log lines in a MarkdownV2 code block, dropping the oldest ones over the limit """
+        escaped = []
+        size = 0
+        for line in reversed(lines):
+            line = line[-(limit // 2):].replace("\\", "\\\\").replace("`", "\\`")
+            size += len(line) + 1
+            if escaped and size > limit:
+                break
+            escaped.append(line)
+        return "```\n" + "\n".join(reversed(escaped)) + "```"
 
     async def _user_info(self, update: Update, _) -> None:
         """
@@ -231,17 +277,7 @@ class MessageHandler(BaseModule):
         await file.download_to_drive(oga_path)
 
         try:
-            sound = AudioSegment.from_file(oga_path, format="ogg")
-            sound.export(flac_path, format="flac")
-            r = sr.Recognizer()
-            with sr.AudioFile(flac_path) as source:
-                audio = r.record(source)
-            text = r.recognize_google(audio, language=language)
-            await update.message.reply_text(f"Transcription: {text}")
-        except sr.UnknownValueError:
-            await update.message.reply_text("Could not understand the audio.")
-        except sr.RequestError:
-            await update.message.reply_text("Error fetching response.")
+            await update.message.reply_text(self.__transcribe(oga_path, flac_path, language))
         except Exception as e: # pylint: disable=W0718
             await update.message.reply_text(f"An error occurred: {e}")
         finally:
@@ -251,6 +287,23 @@ class MessageHandler(BaseModule):
             if os.path.exists(flac_path):
                 os.remove(flac_path)
 
+    @staticmethod
+    def __transcribe(oga_path: str, flac_path: str, language: str) -> str:
+        """ Convert the voice message to flac and recognize the speech, returns the reply """
+        from pydub import AudioSegment # pylint: disable=C0415
+        import speech_recognition as sr # pylint: disable=C0415
+        sound = AudioSegment.from_file(oga_path, format="ogg")
+        sound.export(flac_path, format="flac")
+        r = sr.Recognizer()
+        with sr.AudioFile(flac_path) as source:
+            audio = r.record(source)
+        try:
+            return f"Transcription: {r.recognize_google(audio, language=language)}"
+        except sr.UnknownValueError:
+            return "Could not understand the audio."
+        except sr.RequestError:
+            return "Error fetching response."
+
     def __detect_haikus(self, message: str) -> str | None:
         """ Detect haikus in a message """
         words = message.split()
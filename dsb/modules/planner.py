@@ -8,8 +8,8 @@ from telegram.ext import ContextTypes
 from koleo.api import KoleoAPI
 from dsb.types.lesson import Lesson, str_to_day
 from dsb.types.plan import Plan
-from dsb.types.module import BaseModule, callback_response_decorator, command_handler, \
-    bot_admin_handler, callback_handler
+from dsb.types.module import BaseModule, command_handler, bot_admin_handler, \
+    callback_handler
 from dsb.types.errors import *
 from dsb.utils.transforms import to_index
 from dsb.utils.button_picker import ButtonPicker, CallbackData
@@ -138,7 +138,6 @@ class Planner(BaseModule):
         self.__create_plan(update, context, plan_name)
         await self._like(update)
 
-    @callback_response_decorator
     @callback_handler("delete_plan_callback")
     async def _delete_plan_callback(self, update: Update,
                                     context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -166,7 +165,6 @@ class Planner(BaseModule):
             raise NoPlansFoundError()
         await update.message.reply_text("Choose a plan to delete:", reply_markup=picker)
 
-    @callback_response_decorator
     @callback_handler("get_plan_callback")
     async def _get_plan_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """ Callback for getting a plan """
@@ -178,7 +176,7 @@ class Planner(BaseModule):
         if not plan:
             raise PlanNotFoundError(plan_name)
         await context.bot.delete_message(chat_id, update.effective_message.id)
-        plan_image = plan.to_image(plan_name)
+        plan_image = await self._dsb.render_cache.render_async(plan, plan_name)
         if not plan_image:
             raise PlanEmptyError()
         await context.bot.send_photo(chat_id, photo=plan_image)
@@ -216,7 +214,7 @@ class Planner(BaseModule):
         if plan.is_empty():
             raise PlanEmptyError()
 
-        plan_image = plan.to_image(plan_name)
+        plan_image = await self._dsb.render_cache.render_async(plan, plan_name)
         await update.message.reply_photo(plan_image)
 
     @command_handler("plans")
@@ -288,7 +286,6 @@ class Planner(BaseModule):
         plan.add_lesson(new_lesson.day - 1, new_lesson)
         await self._like(update)
 
-    @callback_response_decorator
     @callback_handler("remove_lesson_callback")
     async def _remove_lesson_callback(self, update: Update,
                                       context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -413,7 +410,6 @@ class Planner(BaseModule):
         plan.add_lesson(new_day - 1 if new_day else day - 1, new_lesson)
         await self._like(update)
 
-    @callback_response_decorator
     @callback_handler("clear_day_callback")
     async def _clear_day_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """ Callback for clearing a day """
@@ -451,7 +447,6 @@ class Planner(BaseModule):
             raise NoPlansFoundError()
         await update.message.reply_text("Choose a plan to clear", reply_markup=picker)
 
-    @callback_response_decorator
     @callback_handler("clear_all_callback")
     async def _clear_all_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """ Callback for clearing all lessons """
@@ -572,7 +567,6 @@ class Planner(BaseModule):
             return
         await update.message.reply_text(f"You have your lesson in {lesson.room}")
 
-    @callback_response_decorator
     @callback_handler("join_plan_callback")
     async def _join_plan_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """ Callback for joining a plan """
@@ -681,7 +675,6 @@ class Planner(BaseModule):
             raise NoPlansFoundError()
         await update.message.reply_text(owners)
 
-    @callback_response_decorator
     @callback_handler("get_students_callback")
     async def _get_students_callback(self, update: Update,
                                      context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -811,7 +804,7 @@ class Planner(BaseModule):
             arrival = ''.join(list(train['arrival'])[11:16])
             message = f"{message}\n{departure} -> {arrival}"
         if send_markup:
-            callback = (0, CallbackData("save_connection", update.effective_user.id,
+            callback = (0, CallbackData("save_connection_callback", update.effective_user.id,
                                         {"from": from_station, "to": to_station}))
             button = InlineKeyboardButton("Save connection", callback_data=callback)
             markup = InlineKeyboardMarkup([[button]])
@@ -819,7 +812,6 @@ class Planner(BaseModule):
             markup = None
         await update.message.reply_text(message, reply_markup=markup)
 
-    @callback_response_decorator
     @callback_handler("save_connection_callback")
     async def _save_connection_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         callback: CallbackData = update.callback_query.data[1]
@@ -8,12 +8,13 @@ from dsb.types.module import BaseModule, HandlerType
 
 class Wordle(BaseModule):
     """ Module for functions related to wordle """
+    _handler_names = {
+        "wordle_among_us": ("_get_amogus", HandlerType.DEFAULT),
+        "wordle_pattern": ("get_pattern", HandlerType.DEFAULT)
+    }
+
     def __init__(self, bot, dsb):
         super().__init__(bot, dsb)
-        self._handlers = {
-            "wordle_among_us": (self._get_amogus, HandlerType.DEFAULT),
-            "wordle_pattern": (self.get_pattern, HandlerType.DEFAULT)
-        }
         self._descriptions = {
             "wordle_among_us": "Get all words required to get amongus image in wordle",
             "wordle_pattern": "Get all words necessary to achieve provided pattern"
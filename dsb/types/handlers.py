@@ -1,4 +1,5 @@
-from telegram.ext import CommandHandler
+from telegram import MessageEntity, Update
+from telegram.ext import BaseHandler, CommandHandler, InvalidCallbackData
 from telegram.ext.filters import User, BaseFilter, UpdateType
 
 class DSBCommandHandler(CommandHandler):
@@ -16,4 +17,123 @@ class AdminCommandHandler(DSBCommandHandler):
                 filters = filters & User(admin)
             else:
                 filters = User(admin)
-        super().__init__(command, callback, filters, block, has_args)
\ No newline at end of file
+        super().__init__(command, callback, filters, block, has_args)
+
+class RouterEntry: # pylint: disable=R0903
+    """ Command registered in the router """
+    __slots__ = ("command", "callback", "admin")
+
+    def __init__(self, command: str, callback, admin: bool) -> None:
+        self.command = command
+        self.callback = callback
+        self.admin = admin
+
+class CommandRouter(BaseHandler):
+    """ Single handler dispatching every command through a dictionary
+
+    Like DSBCommandHandler edited messages are ignored, admin commands only
+    match messages from users in dsb.admins.
+    """
+    def __init__(self, dsb) -> None:
+        super().__init__(self.__unrouted)
+        self._admins = frozenset(dsb.admins)
+        self._commands: dict[str, RouterEntry] = {}
+
+    @property
+    def commands(self) -> dict[str, RouterEntry]:
+        """ Registered commands """
+        return self._commands
+
+    @staticmethod
+    async def __unrouted(*_) -> None:
+        """ Never called, updates go to the callback of the matched command """
+
+    def add(self, command: str, callback, admin: bool = False) -> RouterEntry:
+        """ Route the command to the callback, replacing the previous one """
+        entry = RouterEntry(command.lower(), callback, admin)
+        self._commands[entry.command] = entry
+        return entry
+
+    def remove(self, entry: RouterEntry) -> None:
+        """ Remove the command if it is still routed to the entry """
+        if self._commands.get(entry.command, None) is entry:
+            del self._commands[entry.command]
+
+    def check_update(self, update: object) -> tuple[list[str], RouterEntry] | None:
+        if not isinstance(update, Update) or update.edited_message is not None:
+            return None
+        message = update.effective_message
+        if message is None or not message.entities or not message.text:
+            return None
+        entity = message.entities[0]
+        if entity.type != MessageEntity.BOT_COMMAND or entity.offset != 0:
+            return None
+        command, _, username = message.text[1:entity.length].partition("@")
+        entry = self._commands.get(command.lower(), None)
+        if entry is None:
+            return None
+        if username and username.lower() != message.get_bot().username.lower():
+            return None
+        if entry.admin and (message.from_user is None
+                            or message.from_user.id not in self._admins):
+            return None
+        return message.text.split()[1:], entry
+
+    async def handle_update(self, update, application, check_result, context):
+        context.args = check_result[0]
+        return await check_result[1].callback(update, context)
+
+class CallbackRouter(BaseHandler):
+    """ Single handler dispatching button presses by the prefix of their CallbackData
+
+    Expired buttons are answered here once, presses by anyone but the caller are
+    ignored and cancel buttons remove the picker before any callback runs.
+    """
+    def __init__(self) -> None:
+        super().__init__(self.__unrouted)
+        self._callbacks: dict[str, RouterEntry] = {}
+
+    @property
+    def callbacks(self) -> dict[str, RouterEntry]:
+        """ Registered callback prefixes """
+        return self._callbacks
+
+    @staticmethod
+    async def __unrouted(*_) -> None:
+        """ Never called, updates go to the callback of the matched prefix """
+
+    def add(self, prefix: str, callback) -> RouterEntry:
+        """ Route the prefix to the callback, replacing the previous one """
+        entry = RouterEntry(prefix, callback, False)
+        self._callbacks[prefix] = entry
+        return entry
+
+    def remove(self, entry: RouterEntry) -> None:
+        """ Remove the prefix if it is still routed to the entry """
+        if self._callbacks.get(entry.command, None) is entry:
+            del self._callbacks[entry.command]
+
+    def check_update(self, update: object) -> RouterEntry | bool | None:
+        if not isinstance(update, Update) or update.callback_query is None:
+            return None
+        data = update.callback_query.data
+        if isinstance(data, InvalidCallbackData):
+            return True
+        if not isinstance(data, tuple) or len(data) != 2:
+            return None
+        return self._callbacks.get(getattr(data[1], "prefix", None), None)
+
+    async def handle_update(self, update, application, check_result, context):
+        query = update.callback_query
+        if check_result is True:
+            await update.effective_message.delete()
+            await query.answer(text="This request was too old", show_alert=True)
+            return None
+        callback = query.data[1]
+        if update.effective_user.id != callback.caller:
+            return None
+        if callback.data.get("cancel", False):
+            await context.bot.delete_message(chat_id=update.effective_chat.id,
+                                             message_id=update.effective_message.id)
+            return None
+        return await check_result.callback(update, context)
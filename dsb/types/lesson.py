@@ -96,14 +96,18 @@ class Lesson:
     @property
     def active(self) -> bool:
         """ Returns True if the lesson is active """
+        return self.active_at(datetime.now())
+
+    def active_at(self, moment: datetime) -> bool:
+        """ Returns True if the lesson takes place in the week of the given moment """
         if not hasattr(self, "_repeat"):
             self._repeat = "not"
         if self._repeat == "not":
             return True
-        today = datetime.now().isocalendar()[1]
+        week = moment.isocalendar()[1]
         if self._repeat == "even":
-            return today % 2 == 0
-        return today % 2 != 0
+            return week % 2 == 0
+        return week % 2 != 0
 
     def to_dict(self) -> dict[str, str]:
         """ Returns the lesson as a dictionary """
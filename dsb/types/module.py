@@ -1,16 +1,14 @@
 """ telegram bot base module """
 
 import os
-import functools
-from functools import wraps
 import enum
+import logging
 from typing import TYPE_CHECKING
 from telegram import Update
-from telegram.ext import Application, ContextTypes, CallbackQueryHandler, \
-    InlineQueryHandler, InvalidCallbackData
-from dsb.utils.button_picker import CallbackData
+from telegram.ext import Application, ContextTypes, InlineQueryHandler
 from dsb.types.errors import DSBError
-from dsb.types.handlers import AdminCommandHandler, DSBCommandHandler
+from dsb.types.handlers import RouterEntry
+from dsb.utils.metrics import REGISTRY, timed_callback
 if TYPE_CHECKING:
     from dsb.old_dsb import DSB
 
@@ -41,41 +39,62 @@ def callback_handler(command: str):
         return func
     return decorator
 
-def callback_response_decorator(func):
-    """ Decorator for callback query handlers """
-    @functools.wraps(func)
-    async def wrapper(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """ Wrapper function """
-        if isinstance(update.callback_query.data, InvalidCallbackData):
-            await update.effective_message.delete()
-            await update.callback_query.answer(text="This request was too old", show_alert=True)
-            return
-        callback : CallbackData = update.callback_query.data[1]
-        if update.effective_user.id != callback.caller:
-            return
-        if callback.data.get("cancel", False):
-            await context.bot.delete_message(chat_id=update.effective_chat.id,
-                                       message_id=update.effective_message.id)
-            return
-        await func(self, update, context)
-    return wrapper
+def create_handler(command: str, handler_type: HandlerType, callback):
+    """ Create telegram handler of a type the routers of dsb do not serve """
+    match handler_type:
+        case HandlerType.INLINE:
+            return InlineQueryHandler(callback, pattern=command)
+
+def add_handler(dsb: 'DSB', bot: Application, command: str, handler_type: HandlerType,
+                callback):
+    """ Register the callback, commands and button callbacks go through the routers of dsb """
+    if handler_type in (HandlerType.DEFAULT, HandlerType.BOT_ADMIN):
+        return dsb.router.add(command, callback, handler_type == HandlerType.BOT_ADMIN)
+    if handler_type == HandlerType.CALLBACK:
+        return dsb.callback_router.add(command, callback)
+    handler = create_handler(command, handler_type, callback)
+    bot.add_handler(handler)
+    return handler
+
+def remove_handler(dsb: 'DSB', bot: Application, handler) -> None:
+    """ Unregister handler returned by add_handler """
+    if isinstance(handler, RouterEntry):
+        dsb.router.remove(handler)
+        dsb.callback_router.remove(handler)
+        return
+    try:
+        bot.remove_handler(handler)
+    except ValueError:
+        pass
 
 class BaseModule:
-    """ Base module for all telegram bot modules. """
+    """ Base module for all telegram bot modules.
+
+    Handlers are collected once per class from the handler decorators and the
+    _handler_names table of {command: (method name, handler type)}.
+    """
+    lazy = True
+    _handler_names: dict[str, tuple[str, HandlerType]] = {}
+    _registry: dict[str, tuple[str, HandlerType]] = {}
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        registry = dict(cls._registry)
+        for name, attr in vars(cls).items():
+            if callable(attr) and hasattr(attr, "_command_name"):
+                registry[attr._command_name] = (name, attr._handler_type)
+        registry.update(vars(cls).get("_handler_names", {}))
+        cls._registry = registry
+
     def __init__(self, bot: Application, dsb: 'DSB') -> None:
         self._bot = bot
-        self._handlers = {}
+        self._handlers = {command: (getattr(self, name), handler_type)
+                          for command, (name, handler_type) in self._registry.items()}
         self._descriptions = {}
         self._callback_handlers = {}
         self._inline_handlers = {}
         self._dsb = dsb
         self._handler_list = []
-        for attr_name in dir(self):
-            method = getattr(self, attr_name)
-            if callable(method) and hasattr(method, "_command_name"):
-                name = method._command_name
-                handler_type = method._handler_type
-                self._handlers[name] = (method, handler_type)
 
     @property
     def handlers(self) -> dict:
@@ -115,33 +134,31 @@ class BaseModule:
     def prep(self) -> None:
         """ Prepare the module """
 
+    def warm_up(self) -> None:
+        """ Load expensive resources, runs off the event loop after startup """
+
+    def _timed(self, name: str, kind: str, callback):
+        """ Wrap handler callback so its latency shows up in the metrics """
+        histogram = REGISTRY.histogram("dsb_handler_seconds", "Duration of update handlers",
+                                       handler=name, type=kind)
+        errors = REGISTRY.counter("dsb_handler_errors_total", "Handlers that raised an error",
+                                  handler=name, type=kind)
+        return timed_callback(callback, histogram, errors,
+                              logger=logging.getLogger("DSB"), name=name)
+
     def add_handlers(self) -> None:
         """ Add handlers to the dispatcher """
         for command, handler in self._handlers.items():
             handler_type: HandlerType = handler[1]
-            match handler_type:
-                case HandlerType.DEFAULT:
-                    handler = DSBCommandHandler(command, handler[0])
-                case HandlerType.BOT_ADMIN:
-                    handler = AdminCommandHandler(self._dsb, command, handler[0])
-                case HandlerType.CALLBACK:
-                    handler = CallbackQueryHandler(
-                        handler[0],
-                        pattern=lambda x, func=command: isinstance(x, InvalidCallbackData) \
-                            or x[1].prefix == func
-                    )
-                case HandlerType.INLINE:
-                    handler = InlineQueryHandler(handler[0], pattern=command)
-            self._handler_list.append(handler)
-            self._bot.add_handler(handler)
+            callback = self._timed(command, handler_type.name.lower(), handler[0])
+            self._handler_list.append(add_handler(self._dsb, self._bot, command,
+                                                  handler_type, callback))
 
     def remove_handlers(self) -> None:
         """ Remove handlers from the dispatcher """
         for handler in self._handler_list:
-            try:
-                self._bot.remove_handler(handler)
-            except ValueError:
-                pass
+            remove_handler(self._dsb, self._bot, handler)
+        self._handler_list.clear()
 
     def _get_args(self, context: ContextTypes.DEFAULT_TYPE) -> tuple[list, dict]:
         """ Get the command arguments and options """
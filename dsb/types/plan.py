@@ -1,10 +1,10 @@
 """ Class for Plan """
 
+import json
+import hashlib
 from typing import Literal
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 from io import BytesIO
-import matplotlib.pyplot as plt
-import matplotlib
 from dsb.types.errors import DSBError
 from .lesson import Lesson
 
@@ -18,7 +18,7 @@ class NotInPlanError(DSBError):
     def __init__(self) -> None:
         super().__init__("You are not in the plan")
 
-class Plan:
+class Plan: # pylint: disable=R0904
     """ Plan class containing info about lessons """
     _days = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
 
@@ -45,27 +45,60 @@ class Plan:
     @property
     def next_lesson(self) -> Lesson | None:
         """ Returns the next lesson """
-        today = datetime.now().weekday()
-        now = datetime.now().time()
+        return self.next_lesson_at(datetime.now())
+
+    @property
+    def current_lesson(self) -> Lesson | None:
+        """ Returns the current lesson """
+        return self.current_lesson_at(datetime.now())
+
+    def next_lesson_at(self, moment: datetime) -> Lesson | None:
+        """ Returns the next lesson of the day after the given moment """
+        today = moment.weekday()
+        if today >= len(self._week):
+            return None
+        now = moment.time()
         for lesson in self._week[today]:
-            if not lesson.active:
+            if not lesson.active_at(moment):
                 continue
             if lesson.start_time > now:
                 return lesson
         return None
 
-    @property
-    def current_lesson(self) -> Lesson | None:
-        """ Returns the current lesson """
-        today = datetime.now().weekday()
-        now = datetime.now().time()
+    def current_lesson_at(self, moment: datetime) -> Lesson | None:
+        """ Returns the lesson taking place at the given moment """
+        today = moment.weekday()
+        if today >= len(self._week):
+            return None
+        now = moment.time()
         for lesson in self._week[today]:
-            if not lesson.active:
+            if not lesson.active_at(moment):
                 continue
             if lesson.start_time <= now <= lesson.end_time:
                 return lesson
         return None
 
+    def next_transition_at(self, moment: datetime) -> tuple[datetime, str, Lesson] | None:
+        """ Returns the first lesson start or end after the given moment
+
+        Looks up to two weeks ahead so lessons repeating every other week are found.
+        """
+        for offset in range(15):
+            day = moment.date() + timedelta(days=offset)
+            if day.weekday() >= len(self._week):
+                continue
+            transitions = []
+            for lesson in self._week[day.weekday()]:
+                start = datetime.combine(day, lesson.start_time)
+                if not lesson.active_at(start):
+                    continue
+                end = datetime.combine(day, lesson.end_time)
+                transitions.extend(((start, "lesson_start", lesson), (end, "lesson_end", lesson)))
+            upcoming = [transition for transition in transitions if transition[0] > moment]
+            if upcoming:
+                return min(upcoming, key=lambda transition: transition[0])
+        return None
+
     def get_lessons(self, day: int, lesson_time: time) -> list[Lesson]:
         """ Get the lessons at a specific time """
         lessons = []
@@ -128,6 +161,18 @@ class Plan:
         """ Get all lessons """
         return self._week
 
+    def to_dict(self) -> dict[int, list[dict[str, str]]]:
+        """ Returns the lessons of the plan as a dictionary """
+        return {i: [lesson.to_dict() for lesson in day] for i, day in enumerate(self._week)}
+
+    def to_json(self) -> bytes:
+        """ Returns the lessons of the plan serialized to json """
+        return json.dumps(self.to_dict()).encode()
+
+    def content_hash(self) -> str:
+        """ Returns hash of the lessons, changes whenever the plan content changes """
+        return hashlib.sha1(self.to_json()).hexdigest()
+
     def is_empty(self) -> bool:
         """ Returns True if the plan is empty """
         for day in self._week:
@@ -143,7 +188,14 @@ class Plan:
                 plan += f"{str(lesson)}\n"
         return plan
 
-    def to_image(self, title: str = "Plan") -> bytes:
+    @staticmethod
+    def load_backend() -> None:
+        """ Import matplotlib ahead of the first render """
+        import matplotlib # pylint: disable=C0415
+        matplotlib.use('Agg')
+        import matplotlib.pyplot # pylint: disable=C0415,W0611
+
+    def to_image(self, title: str = "Plan", image_format: str = "png", dpi: int = 600) -> bytes:
         """ Create an image of the plan """
         if self.is_empty():
             return b""
@@ -160,7 +212,9 @@ class Plan:
             "other": "#808080"
         }
 
+        import matplotlib # pylint: disable=C0415
         matplotlib.use('Agg')
+        import matplotlib.pyplot as plt # pylint: disable=C0415
         fig, ax = plt.subplots()
         ax.set_title(title, fontsize=16, color="black")
         fig.legend(handles=[plt.Rectangle((0, 0), 1, 1,
@@ -174,6 +228,27 @@ class Plan:
         for i in range(7, 21):
             ax.plot([0, 5], [i-7, i-7], color="black")
 
+        self.__draw_lessons(ax, colors_by_type)
+
+        ax.set_xlim(0, 5)
+        ax.set_ylim(14, 0)
+        ax.set_yticks(range(14))
+        ax.set_yticklabels([f"{i+7}:00" for i in range(14)], fontsize=8, color="black")
+
+        ax.set_xticks([0.5, 1.5, 2.5, 3.5, 4.5])
+        ax.set_xticklabels(self._days, fontsize=10, color="black", ha='center')
+        ax.xaxis.set_label_position('top')
+        ax.xaxis.tick_top()
+
+        buf = BytesIO()
+        plt.savefig(buf, format=image_format, dpi=dpi)
+        plt.close(fig)
+        buf.seek(0)
+        return buf.getvalue()
+
+    def __draw_lessons(self, ax, colors_by_type: dict[str, str]) -> None:
+        """ Draw lesson boxes on the plan axes """
+        from matplotlib.colors import to_rgba # pylint: disable=C0415
         for i, day in enumerate(self._week):
             for lesson in day:
                 start = lesson.start_time
@@ -182,7 +257,7 @@ class Plan:
                 if not lesson.active:
                     if len(self.get_lessons(i, start)) > 1:
                         continue
-                    color = matplotlib.colors.to_rgba(color, alpha=0.3)
+                    color = to_rgba(color, alpha=0.3)
                 ax.fill_between([i+0.01, i + 0.99], [start.hour - 7 + start.minute / 60],
                                 [end.hour - 7 + end.minute / 60],
                                 color=color, zorder=2,
@@ -193,19 +268,3 @@ class Plan:
                 ax.text(i + 0.5, text_y, lesson_text, color="black",
                         fontdict={"fontsize": 5, "ha": "center", "va": "bottom"},
                         zorder=3)
-
-        ax.set_xlim(0, 5)
-        ax.set_ylim(14, 0)
-        ax.set_yticks(range(14))
-        ax.set_yticklabels([f"{i+7}:00" for i in range(14)], fontsize=8, color="black")
-
-        ax.set_xticks([0.5, 1.5, 2.5, 3.5, 4.5])
-        ax.set_xticklabels(self._days, fontsize=10, color="black", ha='center')
-        ax.xaxis.set_label_position('top')
-        ax.xaxis.tick_top()
-
-        buf = BytesIO()
-        plt.savefig(buf, format="png", dpi=600)
-        plt.close(fig)
-        buf.seek(0)
-        return buf.getvalue()
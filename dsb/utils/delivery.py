@@ -0,0 +1,139 @@
+""" Rate limited fan-out of messages to many chats """
+
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Awaitable, Callable, Iterable
+from telegram.error import Forbidden, BadRequest, NetworkError, RetryAfter
+from dsb.utils.metrics import REGISTRY
+
+class RateLimiter:
+    """ Token bucket shared by every sender """
+    def __init__(self, rate: float, burst: int | None = None) -> None:
+        self._rate = rate
+        self._capacity = burst or max(1, int(rate))
+        self._tokens = float(self._capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """ Stop handing out tokens for a while, used after flood wait errors """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self) -> None:
+        """ Wait for a token """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self._capacity,
+                                   self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self._rate)
+
+class DeliveryReport: # pylint: disable=R0903
+    """ Outcome of a single fan-out run """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.sent = 0
+        self.retries = 0
+        self.failures: dict[int, str] = {}
+
+    def __str__(self) -> str:
+        report = f"{self.name}: sent {self.sent} in {self.duration:.1f}s, " \
+                 f"{self.retries} retries, {len(self.failures)} failed"
+        for chat_id, error in list(self.failures.items())[:10]:
+            report += f"\n{chat_id}: {error}"
+        return report
+
+class Delivery: # pylint: disable=R0903
+    """ Sends to many chats concurrently within Telegram's rate limits
+
+    Bot API allows about 30 messages per second overall and roughly one message
+    every few seconds to the same group, flood wait errors pause every sender.
+    """
+    def __init__(self, concurrency: int = 16, rate: float = 25, chat_interval: float = 3,
+                 max_retries: int = 3, logger: logging.Logger | None = None) -> None:
+        self._concurrency = concurrency
+        self._limiter = RateLimiter(rate)
+        self._chat_interval = chat_interval
+        self._max_retries = max_retries
+        self._last_sent: dict[int, float] = {}
+        self._logger = logger or logging.getLogger("DSB")
+        self.last_report: DeliveryReport | None = None
+
+    @staticmethod
+    def _retry_after(error: RetryAfter) -> float:
+        """ Seconds to wait, newer library versions use timedelta """
+        if isinstance(error.retry_after, timedelta):
+            return error.retry_after.total_seconds()
+        return float(error.retry_after)
+
+    async def __wait_for_chat(self, chat_id: int) -> None:
+        """ Keep the per chat interval """
+        last = self._last_sent.get(chat_id, None)
+        if last is not None:
+            delay = last + self._chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        self._last_sent[chat_id] = time.monotonic()
+
+    async def __deliver(self, chat_id: int, send: Callable[[], Awaitable],
+                        report: DeliveryReport) -> None:
+        """ Send to a single chat, retrying flood waits and network errors """
+        for attempt in range(self._max_retries + 1):
+            await self.__wait_for_chat(chat_id)
+            await self._limiter.acquire()
+            try:
+                await send()
+                report.sent += 1
+                return
+            except RetryAfter as e:
+                delay = self._retry_after(e)
+                self._limiter.pause(delay)
+                error = e
+            except (Forbidden, BadRequest) as e:
+                report.failures[chat_id] = str(e)
+                return
+            except NetworkError as e:
+                delay = 2 ** attempt
+                error = e
+            except Exception as e: # pylint: disable=W0718
+                report.failures[chat_id] = str(e)
+                return
+            if attempt < self._max_retries:
+                report.retries += 1
+                await asyncio.sleep(delay)
+        report.failures[chat_id] = str(error)
+
+    async def run(self, name: str,
+                  jobs: Iterable[tuple[int, Callable[[], Awaitable]]]) -> DeliveryReport:
+        """ Run every (chat id, send) job and return the report """
+        report = DeliveryReport(name)
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def worker(chat_id: int, send: Callable[[], Awaitable]) -> None:
+            async with semaphore:
+                await self.__deliver(chat_id, send, report)
+
+        await asyncio.gather(*(worker(chat_id, send) for chat_id, send in jobs))
+        report.duration = time.monotonic() - report.started
+        REGISTRY.histogram("dsb_delivery_seconds", "Duration of fan-out runs",
+                           run=name).observe(report.duration)
+        REGISTRY.counter("dsb_delivery_sent_total", "Messages sent by fan-out runs",
+                         run=name).inc(report.sent)
+        REGISTRY.counter("dsb_delivery_failed_total", "Messages that could not be delivered",
+                         run=name).inc(len(report.failures))
+        self.last_report = report
+        self._logger.info("Delivery %s", report)
+        return report
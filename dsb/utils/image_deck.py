@@ -0,0 +1,37 @@
+""" No-repeat random selection of images """
+
+import random
+
+class ImageDeck:
+    """ Shuffled deck of images, every image is drawn once before any repeats """
+    def __init__(self, images: list[str] | None = None) -> None:
+        self._images: list[str] = list(images or [])
+        self._cards: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+    def draw(self) -> str | None:
+        """ Take the next image, reshuffling once the deck runs out """
+        if not self._cards:
+            if not self._images:
+                return None
+            self._cards = list(self._images)
+            random.shuffle(self._cards)
+        return self._cards.pop()
+
+    def add(self, image: str) -> None:
+        """ Add image at a random position of the remaining cards """
+        if image in self._images:
+            return
+        self._images.append(image)
+        self._cards.append(image)
+        idx = random.randrange(len(self._cards))
+        self._cards[idx], self._cards[-1] = self._cards[-1], self._cards[idx]
+
+    def remove(self, image: str) -> None:
+        """ Remove image from the deck """
+        if image in self._images:
+            self._images.remove(image)
+        if image in self._cards:
+            self._cards.remove(image)
@@ -0,0 +1,238 @@
+""" Log writing off the event loop, recent records in memory and a reader for the log file """
+
+import os
+import re
+import copy
+import json
+import queue
+import logging
+import logging.handlers
+from collections import deque
+from typing import Iterator
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(module)s - %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+HEADER = re.compile(r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d - ([A-Z]+) - (.*)$", re.DOTALL)
+STRUCTURED_FIELDS = ("chat_id", "user_id", "update_id", "command", "latency_ms")
+
+def parse_level(level: str | int | None) -> int:
+    """ Numeric level of a level name, 0 for None
+
+    Raises:
+        ValueError: When the name is not a logging level
+    """
+    if level is None:
+        return 0
+    if isinstance(level, bool):
+        raise ValueError(f"Unknown log level {level}")
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(level.upper())
+    if not isinstance(value, int):
+        raise ValueError(f"Unknown log level {level}")
+    return value
+
+def update_fields(update, command: str | None = None) -> dict:
+    """ Structured fields describing the update, for the extra of a log record """
+    fields = {"update_id": getattr(update, "update_id", None)}
+    chat = getattr(update, "effective_chat", None)
+    if chat is not None:
+        fields["chat_id"] = chat.id
+    user = getattr(update, "effective_user", None)
+    if user is not None:
+        fields["user_id"] = user.id
+    message = getattr(update, "effective_message", None)
+    text = getattr(message, "text", None) or ""
+    if command is None and text.startswith("/"):
+        command = text.split()[0][1:].split("@")[0]
+    fields["command"] = command
+    return fields
+
+class JsonFormatter(logging.Formatter):
+    """ One JSON object per record, with the STRUCTURED_FIELDS set on it """
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"time": self.formatTime(record, self.datefmt), "level": record.levelname,
+                "module": record.module, "message": record.getMessage()}
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        if record.stack_info:
+            data["stack"] = record.stack_info
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """ Puts records on the queue with the message and traceback already rendered
+
+    Unlike QueueHandler the traceback stays in exc_text instead of being
+    appended to the message, so the formatter of the listener decides where it
+    goes.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+class BatchedFileHandler(logging.handlers.RotatingFileHandler):
+    """ Rotating file handler flushing once batch_size records were written
+
+    StreamHandler flushes after every record, here flush only counts the
+    record and flush_batch writes the buffered ones out.
+    """
+    def __init__(self, filename: str, max_bytes: int = 0, backups: int = 0,
+                 batch_size: int = 100) -> None:
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        self.batch_size = batch_size
+        self._unflushed = 0
+
+    def flush(self) -> None:
+        """ Count the written record, flush when the batch is full """
+        self._unflushed += 1
+        if self._unflushed >= self.batch_size:
+            self.flush_batch()
+
+    def flush_batch(self) -> None:
+        """ Write out the buffered records """
+        self.acquire()
+        try:
+            self._unflushed = 0
+            super().flush()
+        finally:
+            self.release()
+
+class LogListener(logging.handlers.QueueListener):
+    """ Writes queued records on a background thread
+
+    Handlers with flush_batch are flushed whenever the queue runs empty, so a
+    burst of records costs one write while single records are not delayed.
+    """
+    def __init__(self, *handlers: logging.Handler) -> None:
+        super().__init__(queue.SimpleQueue(), *handlers,
+                         respect_handler_level=True)
+
+    def handle(self, record: logging.LogRecord) -> None:
+        super().handle(record)
+        if self.queue.empty():
+            self.flush()
+
+    def flush(self) -> None:
+        """ Flush the batched handlers """
+        for handler in self.handlers:
+            getattr(handler, "flush_batch", handler.flush)()
+
+    def stop(self) -> None:
+        """ Write the remaining records and stop the thread, does nothing when stopped """
+        if self._thread is None:
+            return
+        super().stop()
+        self.flush()
+
+class LogBuffer(logging.Handler):
+    """ Keeps the last `capacity` records, formatted only when read """
+    def __init__(self, capacity: int = 1000) -> None:
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+        self._records: deque[logging.LogRecord] = deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """ Store the record, called with the handler lock held """
+        self._records.append(record)
+
+    def records(self, count: int, level: str | int | None = None,
+                module: str | None = None) -> list[logging.LogRecord]:
+        """ Last count records at or above level from the module, oldest first """
+        minimum = parse_level(level)
+        self.acquire()
+        try:
+            records = list(self._records)
+        finally:
+            self.release()
+        found = []
+        for record in reversed(records):
+            if len(found) >= count:
+                break
+            if record.levelno >= minimum and (module is None or record.module == module):
+                found.append(record)
+        found.reverse()
+        return found
+
+    def lines(self, count: int, level: str | int | None = None,
+              module: str | None = None) -> list[str]:
+        """ Last count formatted records, oldest first """
+        return [self.format(record) for record in self.records(count, level, module)]
+
+def read_backwards(path: str, block_size: int = 8192) -> Iterator[str]:
+    """ Lines of the file from the last one, reading blocks from the end """
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        rest = b""
+        while position > 0:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            lines = (f.read(size) + rest).split(b"\n")
+            rest = lines.pop(0)
+            for line in reversed(lines):
+                yield line.decode("utf-8", "replace")
+        yield rest.decode("utf-8", "replace")
+
+def _header(line: str) -> tuple[str, str] | None:
+    """ Level and module of the first line of a text or JSON record, None for other lines """
+    if line.startswith("{"):
+        try:
+            data = json.loads(line)
+        except ValueError:
+            return None
+        return data.get("level", ""), data.get("module", "")
+    match = HEADER.match(line)
+    if match is None:
+        return None
+    level, rest = match.groups()
+    return level, rest.split(" - ", 1)[0]
+
+def tail(path: str, count: int, level: str | int | None = None, module: str | None = None,
+         backups: int = 0) -> list[str]:
+    """ Last count records of the log file and its rotated backups, oldest first
+
+    Records are in LOG_FORMAT or written by JsonFormatter, lines not starting a
+    record, like tracebacks, belong to the record above them. Only the end of
+    the files is read, the cost depends on how far back the matching records
+    are and not on the size of the log.
+    """
+    minimum = parse_level(level)
+    found: list[str] = []
+    paths = [path] + [f"{path}.{index}" for index in range(1, backups + 1)]
+    for file_path in paths:
+        if not os.path.exists(file_path):
+            break
+        continuation: list[str] = []
+        for line in read_backwards(file_path):
+            header = _header(line)
+            if header is None:
+                if line:
+                    continuation.append(line)
+                continue
+            record = "\n".join([line] + continuation[::-1])
+            continuation = []
+            if parse_level_name(header[0]) < minimum:
+                continue
+            if module is not None and header[1] != module:
+                continue
+            found.append(record)
+            if len(found) >= count:
+                return found[::-1]
+    return found[::-1]
+
+def parse_level_name(name: str) -> int:
+    """ Numeric level of a name read from the file, unknown names count as 0 """
+    value = logging.getLevelName(name)
+    return value if isinstance(value, int) else 0
@@ -0,0 +1,136 @@
+""" Watchdog measuring event loop lag and capturing what blocks the loop """
+
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import deque
+from datetime import datetime
+from types import FrameType
+from telegram import Update
+from dsb.utils.logs import update_fields
+from dsb.utils.metrics import REGISTRY
+
+class LagReport: # pylint: disable=R0903
+    """ Stall of the event loop with the stack of the code that caused it """
+    __slots__ = ("time", "blocked", "handler", "fields", "stack")
+
+    def __init__(self, blocked: float, handler: str | None, fields: dict, stack: str) -> None:
+        self.time = datetime.now()
+        self.blocked = blocked
+        self.handler = handler
+        self.fields = fields
+        self.stack = stack
+
+    def __str__(self) -> str:
+        where = self.handler or "code outside of handlers"
+        details = ", ".join(f"{key} {value}" for key, value in self.fields.items()
+                            if value is not None)
+        if details:
+            where += f" ({details})"
+        return f"{self.time:%Y-%m-%d %H:%M:%S} blocked {self.blocked * 1000:.0f} ms in {where}"
+
+def attribute(frame: FrameType | None) -> tuple[str | None, Update | None]:
+    """ Innermost function with an update argument on the stack and its update """
+    while frame is not None:
+        update = frame.f_locals.get("update", None)
+        if isinstance(update, Update):
+            return frame.f_code.co_qualname, update
+        frame = frame.f_back
+    return None, None
+
+class LoopMonitor: # pylint: disable=R0902
+    """ Measures how late the event loop wakes up and reports when it was blocked
+
+    A task in the loop sleeps for interval and records how much later than
+    that it woke up. A watchdog thread notices when the task has not run for
+    threshold seconds and captures the stack of the loop thread while it is
+    still blocked, attributed to the handler and update being processed. The
+    report is logged right away, so even a loop that never recovers leaves a
+    trace, and the blocked time is completed once the loop runs again.
+    """
+    def __init__(self, threshold: float = 0.25, interval: float = 0.1,
+                 logger: logging.Logger | None = None, history: int = 20) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.max_lag = 0.0
+        self._logger = logger or logging.getLogger("DSB")
+        self._reports: deque[LagReport] = deque(maxlen=history)
+        self._lag = REGISTRY.histogram("dsb_loop_lag_seconds", "Delay of event loop wakeups")
+        self._beat = time.perf_counter()
+        self._reported = 0.0
+        self._pending: LagReport | None = None
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    @property
+    def reports(self) -> list[LagReport]:
+        """ Recent stalls, the newest first """
+        return list(reversed(self._reports))
+
+    def start(self) -> None:
+        """ Start measuring, has to be called from the event loop """
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self.__heartbeat())
+        self._watchdog = threading.Thread(target=self.__watch, name="loop-monitor", daemon=True)
+        self._watchdog.start()
+
+    async def shutdown(self) -> None:
+        """ Stop the heartbeat task and the watchdog """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._stop.set()
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def __heartbeat(self) -> None:
+        """ Record the lag of every wakeup """
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            now = time.perf_counter()
+            self._beat = now
+            lag = max(0.0, now - start - self.interval)
+            self._lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            report = self._pending
+            if report is not None:
+                self._pending = None
+                report.blocked = lag
+
+    def __watch(self) -> None:
+        """ Capture the loop thread stack when the heartbeat is late """
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            stalled = time.perf_counter() - beat
+            if stalled < self.threshold or beat == self._reported:
+                continue
+            frame = sys._current_frames().get(self._loop_thread, None) # pylint: disable=W0212
+            if frame is None:
+                continue
+            self._reported = beat
+            self.__report(frame, stalled)
+
+    def __report(self, frame: FrameType, stalled: float) -> None:
+        """ Attribute the stack to the running handler, log and remember it """
+        handler, update = attribute(frame)
+        fields = update_fields(update) if update is not None else {}
+        stack = "".join(traceback.format_stack(frame, limit=15))
+        report = LagReport(stalled, handler, fields, stack)
+        self._pending = report
+        self._reports.append(report)
+        REGISTRY.counter("dsb_loop_stalls_total", "Event loop stalls over the threshold",
+                         handler=handler or "").inc()
+        self._logger.warning("Event loop blocked for over %.0f ms in %s\n%s",
+                             stalled * 1000, handler or "code outside of handlers",
+                             stack.rstrip(), extra=fields)
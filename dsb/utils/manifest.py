@@ -0,0 +1,131 @@
+""" Static command manifest of bot modules """
+
+import ast
+import os
+from dsb.types.module import HandlerType
+
+DECORATORS = {
+    "command_handler": HandlerType.DEFAULT,
+    "bot_admin_handler": HandlerType.BOT_ADMIN,
+    "callback_handler": HandlerType.CALLBACK,
+}
+
+class ModuleManifest: # pylint: disable=R0903
+    """ Commands, descriptions and docs of a module read from its source """
+    def __init__(self, name: str, import_path: str, file_path: str) -> None:
+        self.name = name
+        self.import_path = import_path
+        self.file_path = file_path
+        self.handlers: dict[str, HandlerType] = {}
+        self.descriptions: dict[str, str] = {}
+        self.docs: dict[str, str | None] = {}
+        self.lazy = True
+
+    @property
+    def static(self) -> bool:
+        """ Returns True if the module can be registered without importing it """
+        return self.lazy and bool(self.handlers)
+
+def _handler_type(node: ast.expr) -> HandlerType | None:
+    """ Read HandlerType.X expression """
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+            and node.value.id == "HandlerType":
+        return HandlerType[node.attr]
+    return None
+
+def _self_attribute(node: ast.expr) -> str | None:
+    """ Read self.x expression """
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+            and node.value.id == "self":
+        return node.attr
+    return None
+
+def _read_init(manifest: ModuleManifest, init: ast.FunctionDef,
+               methods: dict[str, ast.FunctionDef]) -> None:
+    """ Read hand written _handlers and _descriptions dictionaries """
+    for node in ast.walk(init):
+        if not isinstance(node, ast.Assign) or not isinstance(node.value, ast.Dict):
+            continue
+        target = _self_attribute(node.targets[0])
+        for key, value in zip(node.value.keys, node.value.values):
+            if not isinstance(key, ast.Constant):
+                continue
+            if target == "_descriptions" and isinstance(value, ast.Constant):
+                manifest.descriptions[key.value] = value.value
+            elif target == "_handlers" and isinstance(value, ast.Tuple) and len(value.elts) == 2:
+                handler_type = _handler_type(value.elts[1])
+                method = methods.get(_self_attribute(value.elts[0]), None)
+                if handler_type is None:
+                    continue
+                manifest.handlers[key.value] = handler_type
+                manifest.docs[key.value] = ast.get_docstring(method) if method else None
+
+def _read_names(manifest: ModuleManifest, table: ast.Dict,
+                methods: dict[str, ast.FunctionDef]) -> None:
+    """ Read _handler_names class table of {command: (method name, handler type)} """
+    for key, value in zip(table.keys, table.values):
+        if not isinstance(key, ast.Constant) or not isinstance(value, ast.Tuple) \
+                or len(value.elts) != 2 or not isinstance(value.elts[0], ast.Constant):
+            continue
+        handler_type = _handler_type(value.elts[1])
+        if handler_type is None:
+            continue
+        method = methods.get(value.elts[0].value, None)
+        manifest.handlers[key.value] = handler_type
+        manifest.docs[key.value] = ast.get_docstring(method) if method else None
+
+def scan_module(file_path: str, import_path: str, class_name: str) -> ModuleManifest:
+    """ Build manifest of the module class without importing it
+
+    Commands come from handler decorators, the _handler_names class table and
+    dictionary literals assigned to self._handlers and self._descriptions in
+    __init__. A class setting lazy = False, or one whose commands could not be
+    read, has to be imported at startup.
+    """
+    manifest = ModuleManifest(class_name, import_path, file_path)
+    with open(file_path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), file_path)
+    for cls in tree.body:
+        if not isinstance(cls, ast.ClassDef) or cls.name != class_name:
+            continue
+        methods = {node.name: node for node in cls.body
+                   if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+        for node in cls.body:
+            if not isinstance(node, ast.Assign) or not isinstance(node.targets[0], ast.Name):
+                continue
+            if node.targets[0].id == "lazy" and isinstance(node.value, ast.Constant):
+                manifest.lazy = bool(node.value.value)
+            elif node.targets[0].id == "_handler_names" and isinstance(node.value, ast.Dict):
+                _read_names(manifest, node.value, methods)
+        for method in methods.values():
+            for decorator in method.decorator_list:
+                if not isinstance(decorator, ast.Call) or not decorator.args \
+                        or not isinstance(decorator.func, ast.Name) \
+                        or decorator.func.id not in DECORATORS \
+                        or not isinstance(decorator.args[0], ast.Constant):
+                    continue
+                command = decorator.args[0].value
+                manifest.handlers[command] = DECORATORS[decorator.func.id]
+                manifest.docs[command] = ast.get_docstring(method)
+        if "__init__" in methods:
+            _read_init(manifest, methods["__init__"], methods)
+    return manifest
+
+def scan_modules(directory: str = "dsb/modules",
+                 package: str = "dsb.modules") -> dict[str, ModuleManifest]:
+    """ Manifests of every module in the directory, keyed by class name """
+    manifests = {}
+    for file_name in sorted(os.listdir(directory)):
+        if file_name.startswith("__") or not file_name.endswith(".py"):
+            continue
+        stem = file_name.removesuffix(".py")
+        class_name = stem.title().replace("_", "")
+        try:
+            manifest = scan_module(os.path.join(directory, file_name),
+                                   f"{package}.{stem}", class_name)
+        except (SyntaxError, KeyError, UnicodeDecodeError):
+            manifest = ModuleManifest(class_name, f"{package}.{stem}",
+                                      os.path.join(directory, file_name))
+            manifest.lazy = False
+        manifests[class_name] = manifest
+    return manifests
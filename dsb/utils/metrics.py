@@ -0,0 +1,217 @@
+""" Latency histograms and counters exposed in prometheus text format """
+
+import time
+import bisect
+import logging
+import functools
+import threading
+from telegram.request import HTTPXRequest
+from dsb.utils.logs import update_fields
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value) -> str:
+    """ Escape label value for the text format """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Counter:
+    """ Monotonic counter """
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        """ Returns the current value """
+        return self._value
+
+    def inc(self, amount: float = 1) -> None:
+        """ Increase the counter """
+        with self._lock:
+            self._value += amount
+
+class Histogram:
+    """ Histogram with fixed buckets, observing costs a bisect and a lock """
+    __slots__ = ("_buckets", "_counts", "_sum", "_count", "_lock")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def count(self) -> int:
+        """ Returns the number of observations """
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        """ Returns the sum of observed values """
+        return self._sum
+
+    def observe(self, value: float) -> None:
+        """ Record a single value """
+        idx = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+            self._count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        """ Returns (upper bound, cumulative count) pairs, the last bound is inf """
+        with self._lock:
+            counts = list(self._counts)
+        result = []
+        total = 0
+        for bound, count in zip(self._buckets + (float("inf"),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def quantile(self, q: float) -> float:
+        """ Estimate the quantile as the upper bound of the bucket containing it """
+        buckets = self.cumulative()
+        target = q * buckets[-1][1]
+        for bound, total in buckets:
+            if total >= target and total > 0:
+                return bound
+        return 0.0
+
+class Metrics:
+    """ Registry of named metrics with labels """
+    def __init__(self) -> None:
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        self._counters: dict[tuple[str, tuple], Counter] = {}
+        self._descriptions: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str, description: str = "", **labels) -> Histogram:
+        """ Get or create a histogram, keep the result to avoid lookups on hot paths """
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key, None)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+                self._descriptions.setdefault(name, description)
+        return histogram
+
+    def counter(self, name: str, description: str = "", **labels) -> Counter:
+        """ Get or create a counter """
+        key = (name, tuple(sorted(labels.items())))
+        counter = self._counters.get(key, None)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(key, Counter())
+                self._descriptions.setdefault(name, description)
+        return counter
+
+    def histograms(self, name: str) -> list[tuple[dict, Histogram]]:
+        """ Returns all histograms with the given name and their labels """
+        return [(dict(labels), histogram) for (metric, labels), histogram
+                in list(self._histograms.items()) if metric == name]
+
+    def counters(self, name: str) -> list[tuple[dict, Counter]]:
+        """ Returns all counters with the given name and their labels """
+        return [(dict(labels), counter) for (metric, labels), counter
+                in list(self._counters.items()) if metric == name]
+
+    @staticmethod
+    def __labels(labels: tuple, extra: str = "") -> str:
+        """ Format labels in prometheus syntax """
+        parts = [f'{key}="{escape_label(value)}"' for key, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> str:
+        """ Returns every metric in prometheus text exposition format """
+        lines = []
+        described = set()
+        for (name, labels), counter in sorted(list(self._counters.items())):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self._descriptions.get(name, '')}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{self.__labels(labels)} {counter.value}")
+        for (name, labels), histogram in sorted(list(self._histograms.items())):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {self._descriptions.get(name, '')}")
+                lines.append(f"# TYPE {name} histogram")
+            for bound, total in histogram.cumulative():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_labels = self.__labels(labels, 'le="' + le + '"')
+                lines.append(f"{name}_bucket{bucket_labels} {total}")
+            lines.append(f"{name}_sum{self.__labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{self.__labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Metrics()
+
+def timed_callback(callback, histogram: Histogram, errors: Counter, *,
+                   logger: logging.Logger | None = None, name: str | None = None):
+    """ Wrap async callback so its duration and failures are recorded
+
+    With a logger the duration is also logged at debug level, with the chat,
+    user and command of the update as structured fields.
+    """
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            histogram.observe(elapsed)
+            if logger is not None and logger.isEnabledFor(logging.DEBUG):
+                fields = update_fields(args[0] if args else None, name)
+                fields["latency_ms"] = round(elapsed * 1000, 3)
+                logger.debug("Handled %s in %.1f ms", name, elapsed * 1000, extra=fields)
+    return wrapper
+
+class InstrumentedRequest(HTTPXRequest):
+    """ Request class recording latency of every Bot API call
+
+    File downloads share the "file" label, getUpdates long polls wait up to
+    their timeout and are recorded in a histogram of their own.
+    """
+    def __init__(self, *args, metrics: Metrics = REGISTRY, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._metrics = metrics
+
+    @staticmethod
+    def api_method(url: str) -> str:
+        """ Label of the requested Bot API method """
+        if "/file/bot" in url:
+            return "file"
+        return url.rsplit("/", 1)[-1]
+
+    async def do_request(self, url: str, method: str, # pylint: disable=R0913,R0917
+                         request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = self.api_method(url)
+        if api_method == "getUpdates":
+            histogram = self._metrics.histogram("dsb_telegram_poll_seconds",
+                                                "Duration of getUpdates long polls")
+        else:
+            histogram = self._metrics.histogram("dsb_telegram_request_seconds",
+                                                "Duration of Bot API requests",
+                                                method=api_method)
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, method, request_data, read_timeout,
+                                            write_timeout, connect_timeout, pool_timeout)
+        except Exception:
+            self._metrics.counter("dsb_telegram_request_errors_total",
+                                  "Failed Bot API requests", method=api_method).inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
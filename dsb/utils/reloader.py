@@ -0,0 +1,136 @@
+""" Change tracking of bot source files for incremental reloads """
+
+import os
+import ast
+import sys
+import hashlib
+
+CORE_MODULES = {
+    "dsb.utils.logs", "dsb.utils.loop_monitor", "dsb.utils.manifest", "dsb.utils.metrics",
+    "dsb.utils.reloader",
+    "dsb.utils.render_cache", "dsb.utils.scheduler", "dsb.utils.startup",
+    "dsb.utils.update_processor",
+}
+
+def reloadable(name: str) -> bool:
+    """ Returns True if the module can be reloaded without restarting
+
+    Bot modules and helpers can be swapped, the core (dsb.dsb, api, data and
+    the types stored in persistence) keeps references that a reload would break.
+    """
+    if name.startswith("dsb.modules."):
+        return True
+    return name.startswith("dsb.utils.") and name not in CORE_MODULES
+
+class ModuleTracker:
+    """ Remembers the state of loaded dsb source files and their imports """
+    def __init__(self, package: str = "dsb") -> None:
+        self._package = package
+        self._files: dict[str, tuple[int, int, str]] = {}
+
+    def __modules(self) -> dict[str, str]:
+        """ Loaded modules of the package with their files """
+        return {name: module.__file__ for name, module in list(sys.modules.items())
+                if (name == self._package or name.startswith(f"{self._package}."))
+                and getattr(module, "__file__", None)}
+
+    @staticmethod
+    def __state(path: str, digest: str | None = None) -> tuple[int, int, str]:
+        """ Modification time, size and hash of the file """
+        stat = os.stat(path)
+        if digest is None:
+            with open(path, "rb") as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+        return stat.st_mtime_ns, stat.st_size, digest
+
+    def track(self) -> None:
+        """ Remember modules loaded since the last call """
+        for name, path in self.__modules().items():
+            if name not in self._files and os.path.exists(path):
+                self._files[name] = self.__state(path)
+
+    def changed(self) -> set[str]:
+        """ Modules whose source changed since they were loaded, hashes skip plain touches
+
+        A changed module stays changed until mark_loaded records its new state,
+        so a module that failed to reload is retried on the next call.
+        """
+        changed = set()
+        for name, path in self.__modules().items():
+            old = self._files.get(name, None)
+            if old is None or not os.path.exists(path):
+                continue
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size) == old[:2]:
+                continue
+            new = self.__state(path)
+            if new[2] != old[2]:
+                changed.add(name)
+            else:
+                self._files[name] = new
+        return changed
+
+    def mark_loaded(self, name: str) -> None:
+        """ Remember the current state of a module that was just (re)loaded """
+        path = self.__modules().get(name, None)
+        if path is not None and os.path.exists(path):
+            self._files[name] = self.__state(path)
+
+    def __imports(self, name: str, path: str, known: set[str]) -> set[str]:
+        """ Package modules imported by the module """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                tree = ast.parse(f.read(), path)
+        except (OSError, SyntaxError):
+            return set()
+        package = name if path.endswith("__init__.py") else name.rpartition(".")[0]
+        imports = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                targets = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                if node.level:
+                    parent = package.rsplit(".", node.level - 1)[0]
+                    base = f"{parent}.{base}" if base else parent
+                targets = [f"{base}.{alias.name}" for alias in node.names] + [base]
+            else:
+                continue
+            imports.update(target for target in targets if target in known and target != name)
+        return imports
+
+    def dependents(self, names: set[str]) -> set[str]:
+        """ The modules together with every module importing them, directly or not """
+        modules = self.__modules()
+        known = set(modules)
+        importers: dict[str, set[str]] = {}
+        for name, path in modules.items():
+            for imported in self.__imports(name, path, known):
+                importers.setdefault(imported, set()).add(name)
+        result = set(names)
+        pending = list(names)
+        while pending:
+            for importer in importers.get(pending.pop(), ()):
+                if importer not in result:
+                    result.add(importer)
+                    pending.append(importer)
+        return result
+
+    def order(self, names: set[str]) -> list[str]:
+        """ Sort modules so every module comes after the ones it imports """
+        modules = self.__modules()
+        known = set(modules)
+        ordered, visited = [], set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            visited.add(name)
+            for imported in sorted(self.__imports(name, modules[name], known) & names):
+                visit(imported)
+            ordered.append(name)
+
+        for name in sorted(names):
+            if name in modules:
+                visit(name)
+        return ordered
@@ -0,0 +1,104 @@
+""" Cache of rendered plan images """
+
+import copy
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from dsb.types.plan import Plan
+from dsb.utils.metrics import REGISTRY
+
+RENDER_PROFILES = {
+    "full": {"image_format": "png", "dpi": 600},
+    "preview": {"image_format": "png", "dpi": 150},
+    "webp": {"image_format": "webp", "dpi": 300},
+}
+
+CONTENT_TYPES = {
+    "png": "image/png",
+    "webp": "image/webp",
+}
+
+class RenderCache:
+    """ LRU cache of plan images shared by the bot and the api
+
+    Images are rendered on a single background thread (pyplot is not thread safe),
+    concurrent requests for the same image wait for the same render.
+    """
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self._max_bytes = max_bytes
+        self._size = 0
+        self._images: OrderedDict[tuple, bytes] = OrderedDict()
+        self._pending: dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="dsb-render")
+
+    @staticmethod
+    def key(content_hash: str, title: str, profile: str) -> tuple:
+        """ Cache key, odd and even weeks render differently """
+        return content_hash, title, profile, datetime.now().isocalendar()[1] % 2
+
+    def render(self, plan: Plan, title: str, profile: str = "full",
+               content_hash: str | None = None) -> Future:
+        """ Get future with the plan image, rendering it only on a cache miss """
+        if profile not in RENDER_PROFILES:
+            raise ValueError(f"Unknown render profile {profile}")
+        key = self.key(content_hash or plan.content_hash(), title, profile)
+        with self._lock:
+            image = self._images.get(key, None)
+            if image is not None:
+                self._images.move_to_end(key)
+                REGISTRY.counter("dsb_render_cache_total", "Render cache lookups",
+                                 result="hit").inc()
+                future = Future()
+                future.set_result(image)
+                return future
+            future = self._pending.get(key, None)
+            REGISTRY.counter("dsb_render_cache_total", "Render cache lookups",
+                             result="miss" if future is None else "coalesced").inc()
+            if future is None:
+                future = self._executor.submit(self.__render, key, copy.deepcopy(plan),
+                                               title, profile)
+                self._pending[key] = future
+            return future
+
+    async def render_async(self, plan: Plan, title: str, profile: str = "full",
+                           content_hash: str | None = None) -> bytes:
+        """ Await the plan image without blocking the event loop """
+        return await asyncio.wrap_future(self.render(plan, title, profile, content_hash))
+
+    def __render(self, key: tuple, plan: Plan, title: str, profile: str) -> bytes:
+        """ Render the image and store it in the cache """
+        start = time.perf_counter()
+        try:
+            image = plan.to_image(title, **RENDER_PROFILES[profile])
+            REGISTRY.histogram("dsb_render_seconds", "Duration of plan rendering",
+                               profile=profile).observe(time.perf_counter() - start)
+        except Exception:
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+        with self._lock:
+            self._pending.pop(key, None)
+            self._images[key] = image
+            self._size += len(image)
+            while self._size > self._max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._size -= len(evicted)
+        return image
+
+    def warm_up(self) -> None:
+        """ Load matplotlib on the render thread """
+        self._executor.submit(Plan.load_backend).result()
+
+    def clear(self) -> None:
+        """ Drop all cached images """
+        with self._lock:
+            self._images.clear()
+            self._size = 0
+
+    def shutdown(self) -> None:
+        """ Stop the render thread """
+        self._executor.shutdown(wait=False, cancel_futures=True)
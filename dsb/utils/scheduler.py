@@ -0,0 +1,241 @@
+""" Job scheduler running inside the bot event loop """
+
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+class CronTrigger:
+    """ Cron expression with minute, hour, day of month, month and day of week fields """
+    __ranges = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str) -> None:
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression}")
+        self.expression = expression
+        parsed = [self.__parse(field, *bounds) for field, bounds in zip(fields, self.__ranges)]
+        self._minutes, self._hours, self._days, self._months, weekdays = parsed
+        # cron counts weekdays from sunday (0 or 7), datetime from monday
+        self._weekdays = {(day - 1) % 7 for day in weekdays}
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def __parse(field: str, low: int, high: int) -> list[int]:
+        """ Expand a single field to sorted values """
+        values = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(value) for value in part.split("-", 1))
+            else:
+                start = end = int(part)
+                if step:
+                    end = high
+            if start < low or end > high or start > end:
+                raise ValueError(f"Value out of range in cron field: {field}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return sorted(values)
+
+    def __day_matches(self, day: datetime) -> bool:
+        """ Day of month and day of week match like in cron, either one when both are set """
+        if day.month not in self._months:
+            return False
+        by_day = day.day in self._days
+        by_weekday = day.weekday() in self._weekdays
+        if self._any_day:
+            return by_weekday
+        if self._any_weekday:
+            return by_day
+        return by_day or by_weekday
+
+    def next_run(self, after: datetime) -> datetime | None:
+        """ Returns the first matching minute after the given moment """
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(366 * 5):
+            if self.__day_matches(day):
+                for hour in self._hours:
+                    for minute in self._minutes:
+                        moment = day.replace(hour=hour, minute=minute)
+                        if moment >= start:
+                            return moment
+            day += timedelta(days=1)
+        return None
+
+    def __str__(self) -> str:
+        return f"cron {self.expression}"
+
+class OnceTrigger:
+    """ Trigger firing a single time """
+    def __init__(self, when: datetime) -> None:
+        self.when = when
+
+    def next_run(self, after: datetime) -> datetime | None:
+        """ Returns the moment if it did not pass yet """
+        return self.when if self.when > after else None
+
+    def __str__(self) -> str:
+        return f"once at {self.when:%Y-%m-%d %H:%M:%S}"
+
+class Job: # pylint: disable=R0903
+    """ Scheduled coroutine """
+    def __init__(self, name: str, callback: Callable[[], Awaitable], trigger,
+                 jitter: float = 0) -> None:
+        self.name = name
+        self.callback = callback
+        self.trigger = trigger
+        self.jitter = jitter
+        self.next_run: datetime | None = None
+        self.last_run: datetime | None = None
+        self.runs = 0
+        self.failures = 0
+        self.cancelled = False
+
+    def next_after(self, after: datetime) -> datetime | None:
+        """ Compute next run time including the random jitter """
+        moment = self.trigger.next_run(after)
+        if moment is not None and self.jitter:
+            moment += timedelta(seconds=random.uniform(0, self.jitter))
+        self.next_run = moment
+        return moment
+
+    def __str__(self) -> str:
+        next_run = f"{self.next_run:%Y-%m-%d %H:%M:%S}" if self.next_run else "never"
+        return f"{self.name} ({self.trigger}): next {next_run}, runs {self.runs}"
+
+async def wait_for_wakeup(wakeup: asyncio.Event, timeout: float | None) -> None:
+    """ Clear the event and wait until it is set again or timeout seconds pass
+
+    A timeout of None waits without limit, a timeout that already passed
+    returns right away.
+    """
+    wakeup.clear()
+    if timeout is None or timeout > 0:
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+class Scheduler:
+    """ Heap based scheduler living in the event loop
+
+    A single task sleeps until the earliest job is due, without jobs it just
+    waits to be woken up, so an idle bot has no timer wakeups. Long sleeps are
+    capped to an hour so wall clock changes are noticed. Jobs may be added
+    before the loop starts, they begin running after start().
+    """
+    max_sleep = 3600
+
+    def __init__(self, logger: logging.Logger | None = None) -> None:
+        self._logger = logger or logging.getLogger("DSB")
+        self._heap: list[tuple[datetime, int, Job]] = []
+        self._counter = itertools.count()
+        self._jobs: dict[int, Job] = {}
+        self._running: set[asyncio.Task] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """ Start the timer task, has to be called from the event loop """
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self.__run())
+
+    async def shutdown(self) -> None:
+        """ Stop the timer task and wait for running jobs """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def add(self, job: Job) -> Job:
+        """ Schedule the job, safe to call from any thread """
+        if job.next_after(datetime.now()) is None:
+            return job
+        if self._loop is not None and self._loop.is_running():
+            self._loop.call_soon_threadsafe(self.__push, job)
+        else:
+            self.__push(job)
+        return job
+
+    def cron(self, expression: str, callback: Callable[[], Awaitable],
+             name: str | None = None, jitter: float = 0) -> Job:
+        """ Run the coroutine function whenever the cron expression matches """
+        return self.add(Job(name or callback.__name__, callback, CronTrigger(expression), jitter))
+
+    def daily(self, at: str, callback: Callable[[], Awaitable],
+              name: str | None = None, jitter: float = 0) -> Job:
+        """ Run the coroutine function every day at HH:MM """
+        hour, minute = at.split(":")
+        return self.cron(f"{int(minute)} {int(hour)} * * *", callback, name, jitter)
+
+    def once(self, when: datetime | float, callback: Callable[[], Awaitable],
+             name: str | None = None, jitter: float = 0) -> Job:
+        """ Run the coroutine function once, at a moment or after a delay in seconds """
+        if not isinstance(when, datetime):
+            when = datetime.now() + timedelta(seconds=when)
+        return self.add(Job(name or callback.__name__, callback, OnceTrigger(when), jitter))
+
+    def cancel(self, job: Job | None) -> None:
+        """ Cancel the job, its heap entry is skipped when it comes up """
+        if job is None:
+            return
+        job.cancelled = True
+        job.next_run = None
+        self._jobs.pop(id(job), None)
+
+    def jobs(self) -> list[Job]:
+        """ Returns scheduled jobs ordered by their next run """
+        return sorted(self._jobs.values(), key=lambda job: job.next_run or datetime.max)
+
+    def __push(self, job: Job) -> None:
+        """ Put the job on the heap and wake the timer if it is the earliest """
+        if job.cancelled or job.next_run is None:
+            return
+        self._jobs[id(job)] = job
+        entry = (job.next_run, next(self._counter), job)
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def __run(self) -> None:
+        """ Sleep until the earliest job and start every due job """
+        while True:
+            timeout = None
+            if self._heap:
+                timeout = (self._heap[0][0] - datetime.now()).total_seconds()
+                timeout = min(timeout, self.max_sleep)
+            await wait_for_wakeup(self._wakeup, timeout)
+            now = datetime.now()
+            while self._heap and self._heap[0][0] <= now:
+                when, _, job = heapq.heappop(self._heap)
+                if job.cancelled or job.next_run != when:
+                    continue
+                task = self._loop.create_task(self.__execute(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+                if job.next_after(max(now, when)) is None:
+                    self._jobs.pop(id(job), None)
+                else:
+                    self.__push(job)
+
+    async def __execute(self, job: Job) -> None:
+        """ Run the job and log its failure """
+        job.last_run = datetime.now()
+        job.runs += 1
+        try:
+            await job.callback()
+        except Exception as e: # pylint: disable=W0718
+            job.failures += 1
+            self._logger.error("Scheduled job %s failed: %s", job.name, e)
@@ -0,0 +1,40 @@
+""" Startup timings of the bot """
+
+import time
+import threading
+from contextlib import contextmanager
+
+class StartupProfile:
+    """ Named durations of startup and warm-up steps """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.ready: float | None = None
+        self._timings: list[tuple[str, float]] = []
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        """ Add a timing """
+        with self._lock:
+            self._timings.append((name, seconds))
+
+    @contextmanager
+    def measure(self, name: str):
+        """ Time the block """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def mark_ready(self) -> None:
+        """ Remember when the bot started answering updates """
+        self.ready = time.perf_counter() - self.started
+
+    def report(self, limit: int = 25) -> str:
+        """ Timings ranked from the slowest """
+        with self._lock:
+            timings = sorted(self._timings, key=lambda timing: timing[1], reverse=True)
+        lines = [f"{seconds * 1000:8.1f} ms  {name}" for name, seconds in timings[:limit]]
+        if self.ready is not None:
+            lines.insert(0, f"Ready after {self.ready:.2f} s")
+        return "\n".join(lines)
@@ -0,0 +1,76 @@
+""" Concurrent update processing keeping the order of updates within a chat """
+
+import asyncio
+import sys
+import time
+from typing import Any, Awaitable
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from dsb.utils.metrics import REGISTRY
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """ Runs updates of different chats in parallel, updates of one chat one by one
+
+    Handlers change chat_data without locks, so an update only starts after the
+    previous update of its chat finished. Updates without a chat are ordered by
+    their user and ones without either run right away. The semaphore of PTB is
+    taken before do_process_update, so it only bounds pending updates, the limit
+    of running handlers is applied once an update gets its turn in the chat.
+    Otherwise a burst in one chat could hold every slot waiting for its turn.
+    """
+    def __init__(self, max_concurrent_updates: int = 16, max_pending: int = sys.maxsize) -> None:
+        super().__init__(max_pending)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._tails: dict[object, asyncio.Future] = {}
+        self.running = 0
+        self._wait = REGISTRY.histogram("dsb_update_wait_seconds",
+                                        "Time updates waited for their chat and a free slot")
+
+    @staticmethod
+    def order_key(update: object) -> object:
+        """ Updates with the same key are processed in order """
+        if not isinstance(update, Update):
+            return None
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return ("user", update.effective_user.id)
+        return None
+
+    @property
+    def pending_chats(self) -> int:
+        """ Number of chats with an update being processed or waiting """
+        return len(self._tails)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        queued = time.perf_counter()
+        key = self.order_key(update)
+        previous = self._tails.get(key, None) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+        started = False
+        try:
+            if previous is not None:
+                await previous
+            async with self._slots:
+                self._wait.observe(time.perf_counter() - queued)
+                self.running += 1
+                started = True
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        finally:
+            if not started and hasattr(coroutine, "close"):
+                coroutine.close()
+            done.set_result(None)
+            if key is not None and self._tails.get(key, None) is done:
+                del self._tails[key]
+
+    async def initialize(self) -> None:
+        """ Nothing to set up """
+
+    async def shutdown(self) -> None:
+        """ Nothing to clean up """
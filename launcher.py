@@ -1,7 +1,16 @@
 """ Launching file for the application. """
 
-from dsb.dsb import DSB
+import time
+import argparse
+STARTED = time.perf_counter()
+from dsb.dsb import DSB # pylint: disable=C0413
+IMPORTED = time.perf_counter()
 
 if __name__ == "__main__":
-    dsb = DSB()
+    parser = argparse.ArgumentParser(description="Run DatSimonBot")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print ranked import and initialization timings")
+    args = parser.parse_args()
+    dsb = DSB(profile_startup=args.profile_startup)
+    dsb.startup.record("import dsb", IMPORTED - STARTED)
     dsb.start()